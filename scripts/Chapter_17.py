@@ -230,3 +230,772 @@ d6_iter = iter(d6, 1)   # will raise StopIteration when 1 is returned by d6()
 print(d6_iter)      # <callable_iterator object at 0x000001F6BA58F460>
 
 print([x for x in d6_iter]) # [3, 4, 5, 5, 3, 4]
+
+
+############# A Sentence over a huge file :
+# Sentence and SentenceVf need the whole text in memory (a str), before calling RE_WORD.finditer over it.
+# For a multi-GB corpus, we read the file in fixed-size chunks instead:
+#   - The bytes are decoded with an incremental decoder: a UTF-8 char split between two chunks is kept by the decoder until
+#     the next chunk arrives.
+#   - A word that touches the end of the chunk may continue in the next chunk: we keep it (carry), and we search again 
+#     from it when the next chunk is read.
+# The memory used is about the size of one chunk, whatever the size of the file.
+# 
+import codecs
+import os
+
+class SentenceFile:
+    def __init__(self, path, encoding='utf-8', chunk_size=1 << 20) -> None:
+        self.path = path
+        self.encoding = encoding
+        self.chunk_size = chunk_size
+    
+    def __repr__(self) -> str:
+        return 'SentenceFile(%s)' % reprlib.repr(str(self.path))
+
+    def __iter__(self):
+        decoder = codecs.getincrementaldecoder(self.encoding)()
+        carry = ''
+        with open(self.path, 'rb') as fp:
+            while True:
+                chunk = fp.read(self.chunk_size)
+                final = not chunk
+                text = carry + decoder.decode(chunk, final)
+                carry = ''
+                for match in RE_WORD.finditer(text):
+                    if match.end() == len(text) and not final:
+                        carry = match.group()       # This word may continue in the next chunk
+                        break
+                    yield match.group()
+                if final:
+                    return
+
+# Test :
+"""
+from pathlib import Path
+path = Path('/tmp/pig.txt')
+path.write_text('Pig and Pepper. الاسلام café', encoding='utf-8')
+print(list(SentenceFile(path, chunk_size=4)))   # ['Pig', 'and', 'Pepper', 'الاسلام', 'café']  - even with chunks of 4 bytes
+"""
+
+# To compare with read() + finditer, we need a big text file :
+import time
+import tracemalloc
+
+def write_big_text(path, size_mb: int = 100, seed: int = 0) -> None:
+    """Write a text of random words (some of them are not ASCII), about size_mb MB"""
+    rnd = random.Random(seed)
+    vocabulary = ['Pig', 'and', 'Pepper', 'the', 'Cat', 'grinned', 'Alice', 'café', 'naïve', 'الاسلام', 'Ελλάδα', '日本語', 'x']
+    with open(path, 'w', encoding='utf-8') as fp:
+        for _ in range(size_mb):
+            words = rnd.choices(vocabulary, k=170_000)
+            for i in range(0, len(words), 12):
+                fp.write(' '.join(words[i:i + 12]) + '.\n')
+
+def bench_sentence_file(path) -> None:
+    def measure(label, sentence_factory):
+        t0 = time.perf_counter()
+        count = sum(1 for _ in sentence_factory())
+        elapsed = time.perf_counter() - t0
+        tracemalloc.start()
+        for _ in sentence_factory():
+            pass
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        size_mb = os.path.getsize(path) / 2**20
+        print(f'{label:22} {count:10} words {elapsed:7.2f}s {size_mb / elapsed:6.1f} MB/s  peak: {peak / 2**20:7.1f} MiB')
+
+    def read_all():
+        with open(path, encoding='utf-8') as fp:
+            return SentenceVf(fp.read())
+
+    measure('read() + finditer', read_all)
+    measure('SentenceFile', lambda: SentenceFile(path))
+
+# Test :
+"""
+write_big_text('/tmp/big.txt', size_mb=100)
+bench_sentence_file('/tmp/big.txt')
+# read() + finditer        17000000 words    6.56s   17.3 MB/s  peak:   454.4 MiB
+# SentenceFile             17000000 words    6.91s   16.4 MB/s  peak:     6.5 MiB
+# 
+# The same throughput (the time is spent in finditer and in the creation of the words), with a constant memory.
+"""
+
+
+############# Counting words on all the cores :
+# Counting the words of a SentenceFile runs on one core. To use all of them:
+#   1. Split the file into chunks (byte ranges) that end on an ASCII whitespace. A whitespace is never part of a word (\w), and in UTF-8 
+#      an ASCII byte is never part of a multi-byte char: so no word and no char is cut in two.
+#   2. Each worker process reads its chunk, tokenizes it with RE_WORD and returns its local Counter (only the counts travel between 
+#      the processes, not the words).
+#   3. The partial counts are merged two by two (tree reduction): log2(N) rounds of merges that also run in parallel, instead of 
+#      N merges one after the other in the main process.
+# 
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+RE_SPACE = re.compile(rb'\s')
+
+def chunk_bounds(path, chunk_size: int = 16 << 20) -> list[tuple[int, int]]:
+    """Split the file into (start, end) byte ranges of about chunk_size bytes, ending on a whitespace"""
+    size = os.path.getsize(path)
+    bounds = []
+    with open(path, 'rb') as fp:
+        start = 0
+        while start < size:
+            end = start + chunk_size
+            fp.seek(end)
+            while end < size:
+                block = fp.read(4096)
+                match = RE_SPACE.search(block)
+                if match:
+                    end += match.start()
+                    break
+                end += len(block)
+            end = min(end, size)
+            bounds.append((start, end))
+            start = end
+    return bounds
+
+def count_words(path, start: int, end: int) -> Counter:
+    with open(path, 'rb') as fp:
+        fp.seek(start)
+        text = fp.read(end - start).decode('utf-8')
+    return Counter(RE_WORD.findall(text))
+
+def merge_counters(left: Counter, right: Counter) -> Counter:
+    left.update(right)
+    return left
+
+def gather(futures: list) -> list:
+    """The results of the futures, in order. The first exception is raised here, and the pending futures are cancelled"""
+    try:
+        return [future.result() for future in futures]
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+
+def tree_reduce(counters: list[Counter], executor=None) -> Counter:
+    """Merge the counters two by two, each round in parallel when an executor is given"""
+    if not counters:
+        return Counter()
+    while len(counters) > 1:
+        if executor:
+            merged = gather([executor.submit(merge_counters, left, right) for left, right in zip(counters[0::2], counters[1::2])])
+        else:
+            merged = list(map(merge_counters, counters[0::2], counters[1::2]))
+        if len(counters) % 2:
+            merged.append(counters[-1])         # The odd one waits for the next round
+        counters = merged
+    return counters[0]
+
+def word_frequencies(path, workers=None, chunk_size: int = 16 << 20) -> Counter:
+    bounds = chunk_bounds(path, chunk_size)
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        counters = gather([executor.submit(count_words, path, start, end) for start, end in bounds])
+        return tree_reduce(counters, executor)
+    finally:
+        executor.shutdown(cancel_futures=True)  # after an error, don't wait for the chunks that were not started
+
+# Test :
+"""
+if __name__ == '__main__':
+    write_big_text('/tmp/big.txt', size_mb=100)
+    print(word_frequencies('/tmp/big.txt').most_common(3))    # [('الاسلام', 1309404), ('Pepper', 1309107), ('café', 1308950)]
+"""
+
+def bench_word_frequencies(path, max_workers=None) -> None:
+    """Time of word_frequencies with 1 to max_workers processes (and the single-process Counter(SentenceFile))"""
+    max_workers = max_workers or os.cpu_count()
+    t0 = time.perf_counter()
+    expected = Counter(SentenceFile(path))
+    baseline = time.perf_counter() - t0
+    print(f'Counter(SentenceFile):  {baseline:6.2f}s')
+    workers = 1
+    while True:
+        t0 = time.perf_counter()
+        assert word_frequencies(path, workers) == expected
+        elapsed = time.perf_counter() - t0
+        print(f'{workers:3} worker(s):          {elapsed:6.2f}s  speedup: {baseline / elapsed:5.2f}x')
+        if workers >= max_workers:
+            break
+        workers = min(workers * 2, max_workers)
+
+# Test :
+"""
+if __name__ == '__main__':
+    bench_word_frequencies('/tmp/big.txt', max_workers=2)
+# Counter(SentenceFile):    8.97s
+#   1 worker(s):            5.33s  speedup:  1.68x    # findall + Counter in one call is faster than a generator of words
+#   2 worker(s):            5.66s  speedup:  1.59x    # measured on a machine with a single core: no gain from a second process here
+"""
+
+
+############# Random access without a list of words :
+# SentenceV0 supports s[i] and len(s), but it builds the list of all the words (one str object per word) in __init__.
+# Sentence is lazy, but it gives up random access.
+# In between: we keep only the (start, end) offsets of the words, in an array('L') (8 bytes per number, no object per word), and
+# we scan the text only as far as the highest index requested so far. s[i] slices the word from the text on demand.
+# 
+from array import array
+
+class SentenceIndexed:
+    def __init__(self, text) -> None:
+        self.text = text
+        self._offsets = array('L')      # start0, end0, start1, end1, ...
+        self._scanner = RE_WORD.finditer(text)
+    
+    def __repr__(self) -> str:
+        return 'SentenceIndexed(%s)' % reprlib.repr(self.text)
+
+    def _scan_to(self, index: int) -> bool:
+        """Index the words up to index (included). Return False if there are fewer words"""
+        offsets = self._offsets
+        while len(offsets) <= 2 * index:
+            match = next(self._scanner, None)
+            if match is None:
+                return False
+            offsets.extend(match.span())
+        return True
+
+    def __len__(self):
+        for match in self._scanner:     # len() needs all the words
+            self._offsets.extend(match.span())
+        return len(self._offsets) // 2
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < 0 or not self._scan_to(index):
+            raise IndexError('SentenceIndexed index out of range')
+        return self.text[self._offsets[2 * index]:self._offsets[2 * index + 1]]
+
+    def __iter__(self):                 # Like Sentence: iterating does not need the index
+        return (match.group() for match in RE_WORD.finditer(self.text))
+
+# Test :
+"""
+s = SentenceIndexed('Pig and Pepper. الاسلام café')
+print(s[1])                 # and   - only the first 2 words are indexed
+print(s._offsets)           # array('L', [0, 3, 4, 7])
+print(s[-1], len(s))        # café 5
+print(s[1:3])               # ['and', 'Pepper']
+"""
+
+def bench_sentence_indexed(path) -> None:
+    """Memory of the index of all the words: SentenceV0 (list of str) versus SentenceIndexed (array of offsets)"""
+    with open(path, encoding='utf-8') as fp:
+        text = fp.read()
+    for label, cls in (('SentenceV0', SentenceV0), ('SentenceIndexed', SentenceIndexed)):
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        s = cls(text)
+        last = s[len(s) - 1]            # Forces SentenceIndexed to index every word
+        elapsed = time.perf_counter() - t0
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f'{label:16} {len(s):9} words  {size / 2**20:7.1f} MiB  ({size / len(s):5.1f} bytes/word)  {elapsed:6.2f}s')
+        del s
+
+# Test :
+"""
+write_big_text('/tmp/big10.txt', size_mb=10)
+bench_sentence_indexed('/tmp/big10.txt')
+# SentenceV0         1700000 words    112.1 MiB  ( 69.1 bytes/word)    1.75s
+# SentenceIndexed    1700000 words     26.2 MiB  ( 16.2 bytes/word)    4.29s   (the times are slowed down by tracemalloc)
+# 
+# And SentenceIndexed pays only for the words it has reached: s[10] indexes 11 words.
+"""
+
+
+############# A positional inverted index :
+# To find the sentences that contain some words, we should not rescan every Sentence with RE_WORD. We iterate each Sentence once, 
+# when it's added, and we keep for each word its posting list: the ids of the sentences (documents) where it appears, with the 
+# positions of the word in each of them. 
+# To keep the posting lists small, they are cut in blocks of SKIP postings, and each block is packed in a bytearray:
+#   - The doc ids are increasing, so we store the gaps (deltas) between them: small numbers. The positions in a sentence are 
+#     small numbers too, they are stored as they are.
+#   - Each array of the block (doc gaps, freqs, positions) is packed with the narrowest typecode that holds its largest value: 
+#     'B' (1 byte), 'H' (2 bytes), 'I' (4 bytes) or 'Q'. A common word has gaps of 1 or 2 docs: 1 byte each, instead of 4 in 
+#     an array('I') (a fixed width gains nothing from the deltas). This is a variable length encoding by block, not by number 
+#     (like varints): a block is decoded by array.frombytes + accumulate, at C speed, instead of a Python loop over bytes.
+#   - For each block, we keep its first doc id (skip pointers). To look up some docs in a posting list, we find their blocks 
+#     with a binary search over the skip pointers, and we decode only these blocks.
+# An AND query iterates the smallest posting list, and looks up its docs in the others (smallest-posting-first).
+# A phrase query takes the docs of its rarest word, decodes the blocks of each word that may contain them, as ints 
+# (position << 32) + doc id, and intersects the sets of these ints, with the positions of the i-th word shifted back by i.
+# The doc id is in the low bits, not the position: the hash of an int is the int, and a set places it with its low bits, 
+# which would then be a few positions (0, 1, 2...): a lot of collisions.
+# 
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from itertools import accumulate, chain, repeat
+from operator import add, lshift
+
+ITEMSIZES = {typecode: array(typecode).itemsize for typecode in 'BHIQ'}
+
+def narrowest_typecode(values) -> str:
+    """The array typecode with the smallest items that can hold all the values (>= 0)"""
+    bits = max(values, default=0).bit_length()
+    return 'B' if bits <= 8 else 'H' if bits <= 16 else 'I' if bits <= 32 else 'Q'
+
+class Postings:
+    """Posting list of a word: doc ids and positions, in packed blocks of SKIP postings, with skip pointers"""
+    __slots__ = ('data', 'skip_docs', 'offsets', 'typecodes', 'pending', 'count')
+    SKIP = 64
+
+    def __init__(self) -> None:
+        self.data = bytearray()         # the packed blocks, one after the other
+        self.skip_docs = array('I')     # first doc id of each block (the last one is the pending block)
+        self.offsets = array('Q')       # offset of each packed block in data
+        self.typecodes = bytearray()    # 3 typecodes per packed block: doc gaps, freqs, positions
+        self.pending = ([], [], [])     # the last block, until it's full: doc ids, freqs, positions
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def nbytes(self) -> int:
+        return (len(self.data) + len(self.typecodes) + self.skip_docs.itemsize * len(self.skip_docs) 
+                + self.offsets.itemsize * len(self.offsets))
+
+    def append(self, doc_id: int, positions: list[int]) -> None:
+        docs, freqs, flat_positions = self.pending
+        if not docs:
+            self.skip_docs.append(doc_id)
+        docs.append(doc_id)
+        freqs.append(len(positions))
+        flat_positions.extend(positions)
+        self.count += 1
+        if len(docs) == self.SKIP:
+            self._pack()
+
+    def _pack(self) -> None:
+        docs, freqs, positions = self.pending
+        gaps = [current - previous for previous, current in zip(docs, docs[1:])]   # the first doc is in skip_docs
+        self.offsets.append(len(self.data))
+        for values in (gaps, freqs, positions):
+            typecode = narrowest_typecode(values)
+            self.typecodes.append(ord(typecode))
+            self.data += array(typecode, values).tobytes()
+        self.pending = ([], [], [])
+
+    def block_docs(self, block: int):
+        """Doc ids of a block"""
+        if block == len(self.offsets):
+            return self.pending[0]
+        offset = self.offsets[block]
+        typecode = chr(self.typecodes[3 * block])
+        gaps = array(typecode, self.data[offset:offset + (self.SKIP - 1) * ITEMSIZES[typecode]])
+        return accumulate(gaps, initial=self.skip_docs[block])
+
+    def block(self, block: int) -> tuple:
+        """Doc ids, freqs and positions of a block"""
+        if block == len(self.offsets):
+            return self.pending
+        offset = self.offsets[block]
+        arrays = []
+        for size, typecode in zip((self.SKIP - 1, self.SKIP, None), self.typecodes[3 * block:3 * block + 3].decode()):
+            end = offset + (size or sum(arrays[1])) * ITEMSIZES[typecode]      # as many positions as the sum of the freqs
+            arrays.append(array(typecode, self.data[offset:end]))
+            offset = end
+        gaps, freqs, positions = arrays
+        return list(accumulate(gaps, initial=self.skip_docs[block])), freqs, positions
+
+    def doc_ids(self):
+        return chain.from_iterable(map(self.block_docs, range(len(self.skip_docs))))
+
+    def blocks_with(self, docs: list[int]) -> list[int]:
+        """The blocks that may contain some of the docs (sorted), found with the skip pointers"""
+        starts = self.skip_docs
+        if len(docs) < len(starts):         # A few docs: binary search of each doc in the skip pointers
+            blocks = {bisect_right(starts, doc) - 1 for doc in docs}
+            blocks.discard(-1)
+            return sorted(blocks)
+        blocks = []                         # Many docs: binary search of the first doc of each block in the docs
+        last = len(starts) - 1
+        for block, start in enumerate(starts):
+            i = bisect_left(docs, start)
+            if i < len(docs) and (block == last or docs[i] < starts[block + 1]):
+                blocks.append(block)
+        return blocks
+
+    def keys(self, blocks: list[int]):
+        """(position << 32) + doc id of each position in the blocks"""
+        def block_keys(block):
+            docs, freqs, positions = self.block(block)
+            doc_of_each_position = chain.from_iterable(map(repeat, docs, freqs))
+            return map(add, map(lshift, positions, repeat(32)), doc_of_each_position)
+        return chain.from_iterable(map(block_keys, blocks))
+
+
+class InvertedIndex:
+    MAX_DOCS = 1 << 32      # the doc ids are 32-bit: skip_docs is an array('I'), and they are the low bits of the phrase keys
+
+    def __init__(self) -> None:
+        self._postings: dict[str, Postings] = {}
+        self.doc_count = 0
+
+    def __len__(self) -> int:
+        return self.doc_count
+
+    def nbytes(self) -> int:
+        return sum(postings.nbytes() for postings in self._postings.values())
+
+    @staticmethod
+    def normalize(word: str) -> str:
+        return word.casefold()
+
+    def add(self, sentence) -> int:
+        """Index a Sentence (or a str) and return its doc id"""
+        if isinstance(sentence, str):
+            sentence = Sentence(sentence)
+        doc_id = self.doc_count
+        if doc_id >= self.MAX_DOCS:
+            raise OverflowError(f'an InvertedIndex holds at most {self.MAX_DOCS} docs')
+        self.doc_count += 1
+        word_positions = defaultdict(list)
+        for position, word in enumerate(sentence):
+            word_positions[self.normalize(word)].append(position)
+        for word, positions in word_positions.items():
+            postings = self._postings.get(word)
+            if postings is None:
+                postings = self._postings[word] = Postings()
+            postings.append(doc_id, positions)
+        return doc_id
+
+    def _lookup(self, words) -> list[Postings]:
+        """The posting lists of the words, or [] if one of them is not indexed"""
+        postings = [self._postings.get(self.normalize(word)) for word in words]
+        return [] if None in postings else postings
+
+    @staticmethod
+    def _intersect(postings: list[Postings]) -> list[int]:
+        """Docs that are in all the posting lists"""
+        postings = sorted(postings, key=len)            # smallest-posting-first
+        docs = list(postings[0].doc_ids())
+        for other in postings[1:]:
+            if not docs:
+                break
+            found = chain.from_iterable(map(other.block_docs, other.blocks_with(docs)))
+            docs = sorted(set(found).intersection(docs))
+        return docs
+
+    def search_all(self, *words: str) -> list[int]:
+        """Docs that contain all the words (AND)"""
+        postings = self._lookup(words)
+        return self._intersect(postings) if postings else []
+
+    def search_any(self, *words: str) -> list[int]:
+        """Docs that contain at least one of the words (OR)"""
+        docs = set()
+        for word in words:
+            postings = self._postings.get(self.normalize(word))
+            if postings is not None:
+                docs.update(postings.doc_ids())
+        return sorted(docs)
+
+    def search_phrase(self, phrase: str) -> list[int]:
+        """Docs that contain the words of the phrase, one after the other"""
+        postings = self._lookup(RE_WORD.findall(phrase))
+        if not postings:
+            return []
+        docs = list(min(postings, key=len).doc_ids())     # the other docs can't match: skip their blocks
+        starts = set(postings[0].keys(postings[0].blocks_with(docs)))
+        for i in range(1, len(postings)):
+            if not starts:
+                break
+            keys = postings[i].keys(postings[i].blocks_with(docs))
+            starts.intersection_update(map(add, keys, repeat(-i << 32)))
+        return sorted({key & (self.MAX_DOCS - 1) for key in starts})
+
+# Test :
+"""
+index = InvertedIndex()
+index.add('Pig and Pepper')                 # 0
+index.add(Sentence('Pig and Pepper. الاسلام café'))    # 1
+index.add('The Cat and the Pig')            # 2
+print(index.search_all('pig', 'and'))       # [0, 1, 2]
+print(index.search_all('pepper', 'cat'))    # []
+print(index.search_any('pepper', 'cat'))    # [0, 1, 2]
+print(index.search_phrase('Pig and'))       # [0, 1]
+print(index.search_phrase('the pig'))       # [2]
+"""
+
+def bench_inverted_index(sentences: int = 1_000_000, words_per_sentence: int = 10, seed: int = 0) -> None:
+    rnd = random.Random(seed)
+    vocabulary = [f'w{i}' for i in range(50_000)]
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]     # Zipf: a few common words, many rare ones
+    index = InvertedIndex()
+    t0 = time.perf_counter()
+    batch = 10_000
+    for _ in range(sentences // batch):
+        words = rnd.choices(vocabulary, weights, k=batch * words_per_sentence)
+        for i in range(0, len(words), words_per_sentence):
+            index.add(' '.join(words[i:i + words_per_sentence]))
+    elapsed = time.perf_counter() - t0
+    positions = len(index) * words_per_sentence
+    print(f'indexed {len(index)} sentences in {elapsed:.1f}s, {index.nbytes() / positions:.2f} bytes/word')
+
+    queries = [
+        ('AND rare + common', index.search_all, ('w40000', 'w0')),
+        ('AND 2 medium', index.search_all, ('w500', 'w700')),
+        ('AND 3 common', index.search_all, ('w1', 'w2', 'w3')),
+        ('OR 2 medium', index.search_any, ('w500', 'w700')),
+        ('phrase rare', index.search_phrase, ('w40000 w0',)),
+        ('phrase common', index.search_phrase, ('w0 w1',)),
+    ]
+    for label, search, args in queries:
+        repeat = 20
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            found = search(*args)
+        elapsed = (time.perf_counter() - t0) / repeat
+        sizes = ', '.join(str(len(index._postings[w])) for arg in args for w in arg.split())
+        print(f'{label:18} {len(found):7} docs {elapsed * 1e3:9.3f}ms   (posting lists: {sizes})')
+
+# Test :
+"""
+bench_inverted_index(1_000_000)
+# indexed 1000000 sentences in 26.7s, 3.13 bytes/word
+# AND rare + common       15 docs     0.113ms   (posting lists: 22, 601062)
+# AND 2 medium             1 docs     0.235ms   (posting lists: 1831, 1234)
+# AND 3 common         14479 docs    96.017ms   (posting lists: 361104, 256871, 199640)
+# OR 2 medium           3064 docs     0.553ms   (posting lists: 1831, 1234)
+# phrase rare              3 docs     0.583ms   (posting lists: 22, 601062)
+# phrase common        34436 docs   498.233ms   (posting lists: 601062, 361104)
+# 
+# 3.13 bytes per word of the text: with array('I') for the gaps, freqs and positions, it was 11.8 bytes.
+# Below 1ms while one of the words is selective: the skip pointers of the common word select the few blocks to decode. 
+# With only very common words, the skip pointers can't skip anything: every block has one of the docs. The time grows with 
+# the number of positions to decode (about 1.3 million for "w0 w1"), and we stay in pure Python (it was 804ms with the positions 
+# of each doc decoded one by one).
+"""
+
+
+############# Pipelines of generators :
+# A streaming ETL job is a chain of stages: source -> map -> filter -> batch -> ... -> sink.
+# Each stage is a generator function that takes an iterable (the output of the previous stage) and yields items, so the whole chain
+# stays lazy: an item goes through all the stages before the next one is read from the source.
+# 
+#   pipeline = Pipeline(SentenceFile(path)) | mapping(str.lower) | filtering(str.isalpha)
+#   counts = pipeline.run(Counter)
+# 
+# On top of plain generators:
+#   - batched / unbatched stages
+#   - buffered: the previous stages run in a thread, and give their items through a bounded queue (backpressure: they wait when 
+#     the queue is full, so a fast producer can't fill the memory)
+#   - thread_map / process_map: func is applied by a pool, with a bounded number of pending items, and the order is kept
+#   - per-stage counters (items, time), to find the bottleneck: pipeline.report()
+# 
+import itertools
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+def _name(func) -> str:
+    """functools.partial objects, callable instances... have no __name__"""
+    return getattr(func, '__name__', repr(func))
+
+class Stage:
+    """A step of a pipeline: func takes an iterable and returns an iterator"""
+    def __init__(self, func, name=None) -> None:
+        self.func = func
+        self.name = name or _name(func)
+
+    def __repr__(self) -> str:
+        return f'Stage({self.name})'
+
+def stage(func):
+    """Decorator: a generator function (items) -> items becomes a Stage"""
+    return Stage(func)
+
+def mapping(func) -> Stage:
+    return Stage(lambda items: map(func, items), f'mapping({_name(func)})')
+
+def filtering(predicate) -> Stage:
+    return Stage(lambda items: filter(predicate, items), f'filtering({_name(predicate)})')
+
+def batched(size: int) -> Stage:
+    def batch(items):
+        iterator = iter(items)
+        while chunk := list(itertools.islice(iterator, size)):
+            yield chunk
+    return Stage(batch, f'batched({size})')
+
+@stage
+def unbatched(batches):
+    for batch in batches:
+        yield from batch
+
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    """Put the item in the queue, waiting while it's full, unless the consumer has stopped"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def buffered(maxsize: int = 64) -> Stage:
+    def buffer(items):
+        q = queue.Queue(maxsize)
+        stop = threading.Event()
+        def produce():
+            try:
+                for item in items:
+                    if not _put(q, (True, item), stop):
+                        return
+                _put(q, (False, None), stop)
+            except BaseException as exc:        # The exception is raised again in the consumer
+                _put(q, (False, exc), stop)
+        threading.Thread(target=produce, daemon=True).start()
+        try:
+            while True:
+                ok, item = q.get()
+                if ok:
+                    yield item
+                elif item is None:
+                    return
+                else:
+                    raise item
+        finally:
+            stop.set()
+    return Stage(buffer, f'buffered({maxsize})')
+
+def _bounded_map(executor, func, items, max_pending: int):
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(func, item))
+        if len(pending) >= max_pending:         # Backpressure: we don't read more items than the pool can absorb
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def thread_map(func, workers: int = 4, max_pending=None) -> Stage:
+    def run(items):
+        with ThreadPoolExecutor(workers) as executor:
+            yield from _bounded_map(executor, func, items, max_pending or 2 * workers)
+    return Stage(run, f'thread_map({_name(func)}, {workers})')
+
+def process_map(func, workers=None, max_pending=None) -> Stage:
+    """func and the items must be picklable. Combine with batched() to amortize the IPC cost"""
+    workers = workers or os.cpu_count()
+    def run(items):
+        with ProcessPoolExecutor(workers) as executor:
+            yield from _bounded_map(executor, func, items, max_pending or 2 * workers)
+    return Stage(run, f'process_map({_name(func)})')
+
+
+@dataclass
+class StageStats:
+    name: str
+    items: int = 0
+    seconds: float = 0.0                        # Time spent in next() of this stage, including the previous stages
+
+def _timed(iterator, stats: StageStats):
+    perf_counter = time.perf_counter
+    while True:
+        t0 = perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            stats.seconds += perf_counter() - t0
+            return
+        stats.seconds += perf_counter() - t0
+        stats.items += 1
+        yield item
+
+
+class Pipeline:
+    def __init__(self, source, stages=(), timed: bool = True) -> None:
+        self.source = source
+        self.stages = list(stages)
+        self.timed = timed
+        self.stats: list[StageStats] = []
+
+    def __or__(self, other: Stage) -> 'Pipeline':
+        return Pipeline(self.source, [*self.stages, other], self.timed)
+
+    def __iter__(self):
+        iterator = iter(self.source)
+        if not self.timed:
+            for step in self.stages:
+                iterator = iter(step.func(iterator))
+            return iterator
+        self.stats = [StageStats('source')]
+        iterator = _timed(iterator, self.stats[0])
+        for step in self.stages:
+            self.stats.append(StageStats(step.name))
+            iterator = _timed(iter(step.func(iterator)), self.stats[-1])
+        return iterator
+
+    def run(self, sink=None):
+        """Pull all the items through the stages, into sink (ex: list, Counter, sum) if it's given"""
+        if sink is not None:
+            return sink(iter(self))
+        for _ in self:
+            pass
+
+    def report(self) -> str:
+        """Items and time of each stage. 'self' is the time of the stage without the previous ones"""
+        lines = [f'{"stage":36} {"items":>10} {"total":>9} {"self":>9}']
+        previous = 0.0
+        for stats in self.stats:
+            own = max(stats.seconds - previous, 0.0)    # (a threaded stage overlaps with the previous ones)
+            lines.append(f'{stats.name:36} {stats.items:10} {stats.seconds:8.3f}s {own:8.3f}s')
+            previous = stats.seconds
+        return '\n'.join(lines)
+
+# Test :
+"""
+def slow_upper(word):
+    time.sleep(0.001)           # ex: a call to a web service
+    return word.upper()
+
+pipeline = (Pipeline(Sentence('Pig and Pepper ' * 100)) 
+            | filtering(str.istitle)
+            | thread_map(slow_upper, workers=8)
+            | batched(50))
+print([len(batch) for batch in pipeline])       # [50, 50, 50, 50]
+print(pipeline.report())
+# stage                                     items     total      self
+# source                                      300    0.000s    0.000s
+# filtering(istitle)                          200    0.001s    0.000s
+# thread_map(slow_upper, 8)                   200    0.033s    0.032s     # <- the bottleneck
+# batched(50)                                   4    0.033s    0.000s
+"""
+
+# Test :
+"""
+if __name__ == '__main__':
+    @stage
+    def lowercase_words(words):
+        for word in words:
+            yield word.casefold()
+
+    pipeline = (Pipeline(SentenceFile('/tmp/big10.txt'))
+                | buffered(1024)                # reading and tokenizing run in a thread
+                | lowercase_words
+                | batched(10_000)
+                | process_map(Counter)          # one Counter per batch, in another process
+                )
+    total = pipeline.run(lambda counters: sum(counters, Counter()))
+    print(total.most_common(2))     # [('pepper', 131309), ('الاسلام', 131208)]
+    print(pipeline.report())
+# stage                                     items     total      self
+# source                                  1700000    1.238s    1.238s
+# buffered(1024)                          1700000    6.573s    5.335s     # With one core, the two threads fight for the GIL
+# lowercase_words                         1700000    7.325s    0.752s
+# batched(10000)                              170    7.640s    0.314s
+# process_map(Counter)                        170    8.242s    0.602s
+"""
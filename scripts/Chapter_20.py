@@ -196,29 +196,180 @@ class Result(NamedTuple):
 # The idea :
 #  - We have a set of tasks. We will create a number of processes (in this example = number of cpu cores if no argument is given on the comandline)
 #  - Each process will pick a task (check if a number is prime), and once finished, put the result in some place (Here we use another queue).
-#  - For Each worker, we put a value that termines him (Here, we use 0. We can any pickable object). => This techinuqe called Poison Pill
-# 
+#  - For Each worker, we put a value that termines him (Here, we use an empty chunk. We can any pickable object). => This techinuqe called Poison Pill
+#
+# A first version put one number per job and stopped reading the results as soon as jobs.empty() was true: the last
+# jobs could still be running, so their results were lost, and the processes were never joined. HomegrownPool:
+#  - sends the jobs by chunks (a list of numbers per get/put), to pay the cost of the queue once per chunk. The chunks
+#    are "guided": remaining jobs / (2 * workers), so they get smaller at the end and the workers finish together,
+#  - counts the results it expects instead of looking at the job queue,
+#  - stops the workers with one poison pill each and joins them. Before exiting, each worker sends its stats: the
+#    number of jobs, the time spent working (busy) and waiting for a chunk (idle).
+# The messages of the workers are tagged: ('results', jobs, list), ('error', jobs, exception) when function raised for
+# a job of the chunk (the worker goes on with the next chunk, the parent raises the exception), ('stats', 0, WorkerStats).
+# The payload is pickled apart from the tag and the count: if it can't be unpickled in the parent, the count of jobs is
+# not lost. The results come through a Pipe (a SimpleQueue is a Pipe and a Lock), so that the parent can wait on it and
+# on the sentinels of the processes at the same time: a worker that dies (killed, os._exit) never sends the results of
+# its chunk, the parent raises instead of waiting for them.
+# The pool can be reused for several map_unordered calls before it is closed, even one left before its end (break):
+# the results of the chunks already sent are read and dropped.
+#
+import pickle
 import sys
-from multiprocessing import Process, SimpleQueue, cpu_count
-from multiprocessing import queues
+import threading
+from multiprocessing import Lock, Pipe, Process, SimpleQueue, cpu_count
+from multiprocessing import connection, queues, synchronize
+from multiprocessing.connection import wait
 
 class PrimeResult(NamedTuple):
     n: int
     prime: bool
     elapsed: float
 
+class WorkerStats(NamedTuple):
+    worker: int
+    jobs: int
+    busy: float
+    idle: float
+
 # used for type hints
-JobQueue = queues.SimpleQueue[int]
-ResultQueue = queues.SimpleQueue[PrimeResult]
+JobQueue = queues.SimpleQueue[list]
 
 def check(n: int):
     t0 = time.perf_counter()
     res = is_prime(n)
     return PrimeResult(n, res, time.perf_counter() - t0)
 
-def worker(jobs: JobQueue, results: ResultQueue):
-    while n:= jobs.get():   # assign inside a loop with :=
-        results.put(check(n))
+def worker(ident: int, function, jobs: JobQueue, results: connection.Connection, lock: synchronize.Lock):
+    def send(tag: str, count: int, payload) -> None:
+        data = pickle.dumps(payload)
+        with lock:          # one writer at a time on the pipe
+            results.send((tag, count, data))
+
+    count = 0
+    busy = idle = 0.0
+    waiting_since = time.perf_counter()
+    while chunk := jobs.get():   # assign inside a loop with := (an empty chunk is the poison pill)
+        t0 = time.perf_counter()
+        idle += t0 - waiting_since
+        try:
+            send('results', len(chunk), [function(job) for job in chunk])
+        except Exception as exc:
+            try:
+                exc = pickle.loads(pickle.dumps(exc))   # what the parent would get
+            except Exception:       # an exception that can't be sent (or rebuilt): its repr at least
+                exc = RuntimeError(repr(exc))
+            send('error', len(chunk), exc)
+        waiting_since = time.perf_counter()
+        busy += waiting_since - t0
+        count += len(chunk)
+    idle += time.perf_counter() - waiting_since
+    send('stats', 0, WorkerStats(ident, count, busy, idle))
+
+def guided_chunks(jobs: list, workers: int, min_chunk: int = 1, max_chunk: int | None = None):
+    """Chunks of remaining / (2 * workers) jobs: large at the start, small at the end"""
+    start = 0
+    while start < len(jobs):
+        size = max(min_chunk, (len(jobs) - start) // (2 * workers))
+        if max_chunk is not None:
+            size = min(size, max_chunk)
+        yield jobs[start:start + size]
+        start += size
+
+class HomegrownPool:
+    def __init__(self, function, workers: int | None = None):
+        self.workers = workers or cpu_count()
+        self.jobs: JobQueue = SimpleQueue()
+        self.results, writer = Pipe(duplex=False)
+        lock = Lock()
+        self.stats: list[WorkerStats] = []
+        self.procs = [Process(target=worker, args=(i, function, self.jobs, writer, lock)) for i in range(self.workers)]
+        for proc in self.procs:
+            proc.start()
+        writer.close()          # the workers have their copy
+
+    def _receive(self, procs) -> tuple:
+        """The next message of the workers: (tag, count, payload). Raise if one of procs exits before"""
+        while True:
+            ready = wait([self.results] + [proc.sentinel for proc in procs])
+            if self.results in ready:       # the messages sent before a worker exited come first
+                try:
+                    tag, count, data = self.results.recv()
+                except EOFError:            # all the workers have exited
+                    pass
+                else:
+                    try:
+                        payload = pickle.loads(data)
+                    except Exception as exc:
+                        payload, tag = exc, 'error'
+                    return tag, count, payload
+            for proc in procs:
+                if proc.exitcode is not None:
+                    raise RuntimeError(f'worker {self.procs.index(proc)} of HomegrownPool exited with code {proc.exitcode}')
+
+    def map_unordered(self, jobs, min_chunk: int = 1, max_chunk: int | None = None):
+        """Yield function(job) for each job, in the order the results arrive. An exception of function is raised here"""
+        jobs = list(jobs)
+        sent = 0            # jobs put in the queue by the feeder
+        cancel = threading.Event()
+
+        # The chunks are put by a thread: if the parent put them all before reading the results, a worker could block
+        # on a full result pipe while the parent blocks on a full job pipe (a deadlock, with large chunks)
+        def feed() -> None:
+            nonlocal sent
+            for chunk in guided_chunks(jobs, self.workers, min_chunk, max_chunk):
+                if cancel.is_set():
+                    return
+                self.jobs.put(chunk)
+                sent += len(chunk)
+
+        feeder = threading.Thread(target=feed, daemon=True)     # daemon: blocked forever if all the workers die
+        feeder.start()
+        received = 0
+        try:
+            while received < len(jobs):
+                tag, count, payload = self._receive(self.procs)
+                received += count
+                if tag == 'error':
+                    raise payload
+                yield from payload
+        finally:
+            # Stopped before the end (break, exception): no more chunks, and the results of the chunks already sent are
+            # dropped. The feeder can't just be joined: it can be blocked on a full job pipe, and the workers on a full
+            # result pipe, until we read their results.
+            cancel.set()
+            while received < sent or feeder.is_alive():
+                if received < sent:
+                    received += self._receive(self.procs)[1]
+                else:
+                    feeder.join(0.01)       # sent is updated once the put has returned
+
+    def close(self) -> list[WorkerStats]:
+        """Stop the workers and return their stats (a worker that died has none)"""
+        running = [proc for proc in self.procs if proc.is_alive()]
+        for _ in running:
+            self.jobs.put([])       # Poison Pill for each worker to stop him once finished
+        stats = []
+        while running:
+            try:
+                tag, _, payload = self._receive(running)
+            except RuntimeError:    # a worker died: it won't send its stats
+                running = [proc for proc in running if proc.exitcode is None]
+                continue
+            if tag == 'stats':      # anything else is left from a map_unordered that was stopped by an exception
+                stats.append(payload)
+                running.remove(self.procs[payload.worker])
+        self.stats = sorted(stats)
+        for proc in self.procs:
+            proc.join()
+        self.results.close()
+        return self.stats
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
 def main() -> None:
     # Check if an argument is the command line :
@@ -228,34 +379,20 @@ def main() -> None:
         workers = int(sys.argv[1])
     
     print(f'Checking {len(NUMBERS)} numbers with {workers} processes :')
-    jobs : JobQueue = SimpleQueue()
-    results : ResultQueue = SimpleQueue()
-
     t0 = time.perf_counter()
+    with HomegrownPool(check, workers) as pool:
+        for n, prime, elapsed in pool.map_unordered(NUMBERS):
+            label = 'P' if prime else ' '
+            print(f'{n:16} {label} {elapsed:9.6f}s')
 
-    # Put the numbers in the job queue :
-    for n in NUMBERS:
-        jobs.put(n)
-
-    # Create and start processes :
-    for _ in range(workers):
-        proc = Process(target=worker, args=(jobs, results))
-        proc.start()
-        jobs.put(0)     # Poison Pill for each worker to stop him once finished
-    
-    while True:
-        n, prime, elapsed = results.get()
-        label = 'P' if prime else ' '
-        print(f'{n:16} {label} {elapsed:9.6f}s')
-        if jobs.empty():
-            break
-        
     elapsed = time.perf_counter() - t0
     print(f"Total time: {elapsed:.2f}s")
+    for ident, jobs, busy, idle in pool.stats:
+        print(f'worker {ident}: {jobs:3} jobs, busy {busy:6.2f}s, idle {idle:6.2f}s ({busy / (busy + idle):.0%} utilization)')
 
 if __name__ == '__main__':
     main()
-# Output :
+# Output (first version, one number per job) :
 # Checking 20 numbers with 4 processes :
 #                2 P  0.000002s
 # 3333333333333333    0.000008s
@@ -279,6 +416,33 @@ if __name__ == '__main__':
 # 9999999999999917 P 11.238177s
 # Total time: 39.88s
 
+# Output of HomegrownPool (python Chapter_20.py 2, on a machine with a single core) :
+# Checking 20 numbers with 2 processes :
+#                2 P  0.000007s
+#  142702110479723 P  0.550095s
+#  299593572317531 P  0.785506s
+# 3333333333333301 P  2.396204s
+# 3333333333333333    0.000017s
+# 3333335652092209    2.529616s
+# 4444444444444423 P  2.683686s
+# 4444444444444444    0.000003s
+# 5555555555555555    0.000007s
+# 6666666666666666    0.000000s
+# 6666666666666719 P  3.153489s
+# 6666667141414921    3.200591s
+# 4444444488888889    2.653275s
+# 5555553133149889    2.776421s
+# 5555555555555503 P  2.985801s
+# 7777777536340681    3.796756s
+# 7777777777777777    0.000008s
+# 7777777777777753 P  3.762392s
+# 9999999999999999    0.000008s
+# 9999999999999917 P  2.190205s
+# Total time: 17.58s
+# worker 0:  10 jobs, busy  15.91s, idle   1.66s (91% utilization)
+# worker 1:  10 jobs, busy  17.57s, idle   0.00s (100% utilization)
+# (busy is wall time: with one core, the two processes share it)
+
 # Conclusion :
 # multi-process based solution is faster
 # The same exercise with threads is less performant than sequential code (mentienned in the book)
@@ -286,3 +450,473 @@ if __name__ == '__main__':
 
 
 
+
+############### Miller-Rabin primality test :
+# is_prime tries every odd divisor up to √n: about 5·10^7 divisions for a 16-digit prime, seconds per number.
+# Miller-Rabin uses Fermat's little theorem: for a prime n = 2^s·d + 1 (d odd) and any a (a witness), either
+# a^d ≡ 1 (mod n) or a^(2^r·d) ≡ -1 (mod n) for some r < s. A composite n fails this for most witnesses.
+# Each witness costs one pow(a, d, n): O(log n) multiplications, microseconds for 64-bit numbers.
+#   - Deterministic: some fixed witness sets have been checked against every composite below a bound. The 7 witnesses
+#     of Jim Sinclair are enough for every n < 2^64, and the first 13 primes for every n < 3.3·10^24.
+#   - Above that bound, random witnesses: each round lets a composite pass with a probability <= 1/4.
+# is_prime stays as the reference implementation: differential_test compares both.
+import random
+
+SMALL_PRIMES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53, 59, 61, 67, 71, 73, 79, 83, 89, 97)
+WITNESSES_64 = (2, 325, 9375, 28178, 450775, 9780504, 1795265022)
+WITNESSES_FIRST_13_PRIMES = SMALL_PRIMES[:13]
+FIRST_13_PRIMES_BOUND = 3_317_044_064_679_887_385_961_981    # the smallest composite that passes them all
+
+def _is_strong_probable_prime(n: int, d: int, s: int, a: int) -> bool:
+    """Miller-Rabin round for n - 1 = 2^s·d, with the witness a"""
+    x = pow(a, d, n)
+    if x == 1 or x == n - 1:
+        return True
+    for _ in range(s - 1):
+        x = x * x % n
+        if x == n - 1:
+            return True
+    return False
+
+def is_prime_mr(n: int, rounds: int = 40, rnd: random.Random | None = None) -> bool:
+    """Deterministic for n < 3.3·10^24; above, a composite passes with probability <= 4**-rounds"""
+    if n < 2:
+        return False
+    for p in SMALL_PRIMES:      # screening: most composites have a small factor
+        if n % p == 0:
+            return n == p
+    if n < SMALL_PRIMES[-1] ** 2:
+        return True
+    s = ((n - 1) & (1 - n)).bit_length() - 1       # number of trailing zero bits of n - 1
+    d = (n - 1) >> s
+    if n < 1 << 64:
+        witnesses = (a % n for a in WITNESSES_64)
+    elif n < FIRST_13_PRIMES_BOUND:
+        witnesses = WITNESSES_FIRST_13_PRIMES
+    else:
+        rnd = rnd or random
+        witnesses = (rnd.randrange(2, n - 1) for _ in range(rounds))
+    return all(_is_strong_probable_prime(n, d, s, a) for a in witnesses if a)    # a ≡ 0 (mod n) proves nothing
+
+def differential_test(limit: int = 200_000) -> None:
+    """is_prime_mr against is_prime on [0, limit), the fixture, and composites that fool weaker witness sets"""
+    for n in range(limit):
+        assert is_prime_mr(n) == is_prime(n), n
+    for n, prime in PRIME_FIXTURE:
+        assert is_prime_mr(n) == prime, n
+    strong_pseudoprimes = (
+        2047,                   # 23 · 89: passes the base 2
+        3215031751,             # 151 · 751 · 28351: passes the bases 2, 3, 5 and 7
+        3825123056546413051,    # 149491 · 747451 · 34233211: passes the prime bases up to 23
+        318665857834031151167461,   # passes the prime bases up to 37: 41 is needed
+    )
+    assert not any(is_prime_mr(n) for n in strong_pseudoprimes)
+    assert is_prime_mr(2**89 - 1) and not is_prime_mr(2**89 + 1)
+    assert is_prime_mr(2**521 - 1, rnd=random.Random(0))          # the probabilistic mode
+    print(f'is_prime_mr agrees with is_prime on [0, {limit}) and on the fixture')
+
+def check_fixture_mr() -> None:
+    """The sequential approach above, with is_prime_mr"""
+    t0 = time.perf_counter()
+    for n in NUMBERS:
+        t1 = time.perf_counter()
+        prime = is_prime_mr(n)
+        label = 'P' if prime else ' '
+        print(f'{n:16}  {label}   {time.perf_counter() - t1:9.6f}s')
+    print(f'Total time: {(time.perf_counter() - t0) * 1e3:.2f}ms')
+
+# differential_test()   # is_prime_mr agrees with is_prime on [0, 200000) and on the fixture
+# check_fixture_mr()      # instead of 67s with is_prime
+#                2  P    0.000025s
+#  142702110479723  P    0.000081s
+#  299593572317531  P    0.000074s
+# 3333333333333301  P    0.000072s
+# 3333333333333333       0.000002s
+# 3333335652092209       0.000025s
+# 4444444444444423  P    0.000075s
+# 4444444444444444       0.000002s
+# 4444444488888889       0.000018s
+# 5555553133149889       0.000014s
+# 5555555555555503  P    0.000135s
+# 5555555555555555       0.000003s
+# 6666666666666666       0.000001s
+# 6666666666666719  P    0.000079s
+# 6666667141414921       0.000021s
+# 7777777536340681       0.000014s
+# 7777777777777753  P    0.000074s
+# 7777777777777777       0.000001s
+# 9999999999999917  P    0.000105s
+# 9999999999999999       0.000002s
+# Total time: 0.94ms
+
+############### Segmented sieve :
+# To know the primality of every number in a range, testing the numbers one by one repeats the same work: the sieve of
+# Eratosthenes crosses out the multiples of each prime p <= √b once, with a slice assignment (a loop in C):
+#   flags[start::p] = bytes(count)
+# A bytearray for [0, b) does not fit in memory for large b, and is slow even when it does: each prime walks through
+# the whole array, outside of the CPU cache. The segmented sieve processes [a, b) by segments of SEGMENT_SIZE bytes,
+# small enough to stay in the L2 cache, with the base primes (<= √b) computed once.
+# Segments are independent: blocks of segments can be sieved in parallel by a pool of processes.
+import bisect
+from concurrent.futures import ProcessPoolExecutor
+
+SEGMENT_SIZE = 1 << 18          # 256 KiB
+SEGMENTS_PER_TASK = 64          # a task of the process pool: 16M numbers, so the base primes are sent once per task
+
+def base_primes(limit: int) -> list[int]:
+    """The primes <= limit, with a plain sieve"""
+    if limit < 2:
+        return []
+    flags = bytearray([1]) * (limit + 1)
+    flags[0] = flags[1] = 0
+    for p in range(2, math.isqrt(limit) + 1):
+        if flags[p]:
+            flags[p * p::p] = bytes((limit - p * p) // p + 1)
+    return [n for n, flag in enumerate(flags) if flag]
+
+def sieve_segments(a: int, b: int, primes: list[int] | None = None):
+    """Yield (low, flags) for consecutive segments of [a, b): flags[i] is 1 if low + i is prime"""
+    a = max(a, 0)
+    if primes is None:
+        primes = base_primes(math.isqrt(b - 1)) if b > 1 else []
+    for low in range(a, b, SEGMENT_SIZE):
+        high = min(low + SEGMENT_SIZE, b)
+        flags = bytearray([1]) * (high - low)
+        for p in primes:
+            square = p * p
+            if square >= high:
+                break
+            start = max(square, (low + p - 1) // p * p)     # the first multiple of p in the segment (not p itself)
+            if start < high:
+                flags[start - low::p] = bytes((high - 1 - start) // p + 1)
+        for n in range(low, min(high, 2)):      # 0 and 1
+            flags[n - low] = 0
+        yield low, flags
+
+def _count_block(a: int, b: int, primes: list[int]) -> int:
+    return sum(flags.count(1) for _, flags in sieve_segments(a, b, primes))
+
+def _primes_block(a: int, b: int, primes: list[int]) -> list[int]:
+    return [low + i for low, flags in sieve_segments(a, b, primes) for i, flag in enumerate(flags) if flag]
+
+def _run_blocks(function, a: int, b: int, workers: int | None):
+    """function(block_a, block_b, primes) for each block of [a, b), in order; in a process pool when workers is given"""
+    primes = base_primes(math.isqrt(b - 1)) if b > 1 else []
+    span = SEGMENT_SIZE * SEGMENTS_PER_TASK
+    starts = range(max(a, 0), b, span)
+    ends = [min(start + span, b) for start in starts]
+    if workers is None or len(starts) < 2:
+        return [function(start, end, primes) for start, end in zip(starts, ends)]
+    with ProcessPoolExecutor(workers) as executor:
+        return list(executor.map(function, starts, ends, [primes] * len(starts)))
+
+def count_primes(a: int, b: int, workers: int | None = None) -> int:
+    """Number of primes in [a, b)"""
+    return sum(_run_blocks(_count_block, a, b, workers))
+
+def primes_in_range(a: int, b: int, workers: int | None = None) -> list[int]:
+    """The primes in [a, b), in increasing order"""
+    return [p for block in _run_blocks(_primes_block, a, b, workers) for p in block]
+
+# Bulk test: numbers close to each other are sieved together, isolated numbers are tested with Miller-Rabin.
+# Sieving a cluster costs about one crossing-out pass per base prime and per segment, plus the span of the cluster;
+# Miller-Rabin costs a few microseconds per number. The estimates below are in nanoseconds, measured on CPython 3.11.
+CLUSTER_GAP = 4096
+SIEVE_NS_PER_NUMBER = 2
+SIEVE_NS_PER_BASE_PRIME = 300
+MR_NS_PER_NUMBER = 3000
+
+def _sieve_is_cheaper(low: int, high: int, count: int) -> bool:
+    segments = (high - low) // SEGMENT_SIZE + 1
+    base_prime_count = math.isqrt(high) / max(math.log(math.isqrt(high) + 1), 1)   # π(√high), approximately
+    sieve_cost = (high - low) * SIEVE_NS_PER_NUMBER + segments * base_prime_count * SIEVE_NS_PER_BASE_PRIME
+    return sieve_cost < count * MR_NS_PER_NUMBER
+
+def are_prime(numbers) -> list[bool]:
+    """The primality of each number, in the order of numbers"""
+    numbers = list(numbers)
+    values = sorted(set(numbers))
+    primes = set()
+    i = 0
+    while i < len(values):
+        j = i + 1
+        while j < len(values) and values[j] - values[j - 1] <= CLUSTER_GAP:
+            j += 1
+        cluster = values[i:j]
+        low, high = cluster[0], cluster[-1] + 1
+        if high > 2 and _sieve_is_cheaper(low, high, len(cluster)):
+            for segment_low, flags in sieve_segments(low, high):
+                first = bisect.bisect_left(cluster, segment_low)
+                last = bisect.bisect_left(cluster, segment_low + len(flags))
+                primes.update(n for n in cluster[first:last] if flags[n - segment_low])
+        else:
+            primes.update(n for n in cluster if is_prime_mr(n))
+        i = j
+    return [n in primes for n in numbers]
+
+def bench_sieve(b: int = 100_000_000, workers: int | None = None) -> None:
+    """Numbers per second: count_primes, primes_in_range, are_prime, versus is_prime_mr and is_prime per number"""
+    workers = workers or cpu_count()
+
+    def report(label, count, function, *args):
+        t0 = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - t0
+        print(f'{label:46} {count / elapsed:14,.0f} numbers/s')
+        return result
+
+    primes = report(f'count_primes(0, {b:.0e})', b, count_primes, 0, b)
+    assert primes == report(f'count_primes(0, {b:.0e}), {workers} processes', b, count_primes, 0, b, workers)
+    report(f'primes_in_range(0, {b // 10:.0e})', b // 10, primes_in_range, 0, b // 10)
+    dense = range(10**12, 10**12 + 10**6)
+    flags = report('are_prime, 1e6 consecutive numbers near 1e12', len(dense), are_prime, dense)
+    sample = dense[:20_000]
+    assert flags[:len(sample)] == report('is_prime_mr per number, near 1e12', len(sample), lambda: [is_prime_mr(n) for n in sample])
+    sample = dense[:2_000]
+    assert flags[:len(sample)] == report('is_prime (trial division), near 1e12', len(sample), lambda: [is_prime(n) for n in sample])
+    print(f'{primes} primes below {b:.0e}')
+
+# bench_sieve()     # on a machine with a single core: no gain from the process pool here
+# count_primes(0, 1e+08)                            181,261,287 numbers/s
+# count_primes(0, 1e+08), 1 processes               213,912,427 numbers/s
+# primes_in_range(0, 1e+07)                          29,907,187 numbers/s
+# are_prime, 1e6 consecutive numbers near 1e12        1,428,060 numbers/s
+# is_prime_mr per number, near 1e12                     398,097 numbers/s
+# is_prime (trial division), near 1e12                    1,388 numbers/s
+# 5761455 primes below 1e+08
+
+############### One number, all the cores :
+# The pools above check several numbers at the same time: they do not help when one number dominates, like
+# 9999999999999917 (8 seconds alone). For a single n, the candidate divisors 3..√n can be split into one range per
+# process. A prime needs every range to be checked, so the latency is divided by the number of cores. A composite needs
+# only one divisor: the process that finds it sets a shared Event, and the others look at it regularly and stop.
+# Before starting processes (a few milliseconds each), the parent checks the small primes: most composites stop there.
+# The parent waits for the processes to exit, not for their results: a process that raises or is killed never sends
+# one. As soon as a process exits with an error, the others are cancelled with the Event and the check raises.
+from multiprocessing import Event as ProcessEvent
+from multiprocessing import synchronize
+from multiprocessing.connection import wait
+
+CANCEL_CHECK_EVERY = 1 << 16        # candidates between two looks at the Event: a few milliseconds
+
+def _first_divisor(n: int, start: int, stop: int, found: synchronize.Event) -> int:
+    """The first odd divisor of n in [start, stop) (start is odd), or 0; stops early when found is set"""
+    for block in range(start, stop, 2 * CANCEL_CHECK_EVERY):
+        if found.is_set():
+            return 0
+        for i in range(block, min(block + 2 * CANCEL_CHECK_EVERY, stop), 2):
+            if n % i == 0:
+                found.set()
+                return i
+    return 0
+
+def _divisor_worker(n: int, start: int, stop: int, found: synchronize.Event, results: queues.SimpleQueue) -> None:
+    results.put(_first_divisor(n, start, stop, found))
+
+def is_prime_split(n: int, workers: int | None = None) -> bool:
+    """is_prime(n), with the trial divisions split across worker processes"""
+    if n < 2:
+        return False
+    for p in SMALL_PRIMES:
+        if n % p == 0:
+            return n == p
+    first, last = SMALL_PRIMES[-1] + 2, math.isqrt(n)     # odd candidates in [first, last]
+    if first > last:
+        return True
+    workers = workers or cpu_count()
+    candidates = (last - first) // 2 + 1
+    per_worker = -(-candidates // workers)      # ceil
+    found = ProcessEvent()
+    results: queues.SimpleQueue = SimpleQueue()
+    procs = []
+    for start in range(first, last + 1, 2 * per_worker):
+        stop = min(start + 2 * per_worker, last + 1)
+        proc = Process(target=_divisor_worker, args=(n, start, stop, found, results))
+        proc.start()
+        procs.append(proc)
+    running = {proc.sentinel: proc for proc in procs}
+    while running:
+        for sentinel in wait(running):
+            proc = running.pop(sentinel)
+            proc.join()
+            if proc.exitcode:
+                found.set()
+                for other in running.values():
+                    other.join()
+                raise RuntimeError(f'is_prime_split({n}): a worker exited with code {proc.exitcode}')
+    divisors = [results.get() for _ in procs]     # one per process, sent before it exited
+    return not any(divisors)
+
+def bench_split(numbers=(9999999999999917, 7777777536340681, 1000003 * 9999999967), workers_list=(1, 2, 4)) -> None:
+    """Latency of one check: is_prime versus is_prime_split with 1, 2, 4... processes"""
+    for n in numbers:
+        t0 = time.perf_counter()
+        prime = is_prime(n)
+        print(f'{n:17} {"P" if prime else " "} is_prime:                  {time.perf_counter() - t0:6.2f}s')
+        for workers in workers_list:
+            t0 = time.perf_counter()
+            assert is_prime_split(n, workers) == prime
+            print(f'{n:17} {"P" if prime else " "} is_prime_split, {workers} workers: {time.perf_counter() - t0:6.2f}s')
+
+# if __name__ == '__main__':
+#     bench_split()
+# On a machine with a single core, the processes share it: the latency cannot go down, but the composite
+# 1000003 * 9999999967 shows the cancellation: the first range finds 1000003, and the others stop at once.
+#  9999999999999917 P is_prime:                    2.25s
+#  9999999999999917 P is_prime_split, 1 workers:   2.62s
+#  9999999999999917 P is_prime_split, 2 workers:   2.66s
+#  9999999999999917 P is_prime_split, 4 workers:   2.25s
+#  7777777536340681   is_prime:                    1.73s
+#  7777777536340681   is_prime_split, 1 workers:   1.70s
+#  7777777536340681   is_prime_split, 2 workers:   1.75s
+#  7777777536340681   is_prime_split, 4 workers:   1.84s
+# 10000029966999901   is_prime:                    0.02s
+# 10000029966999901   is_prime_split, 1 workers:   0.02s
+# 10000029966999901   is_prime_split, 2 workers:   0.04s
+# 10000029966999901   is_prime_split, 4 workers:   0.10s
+# With N cores, a prime takes about 1/N of the time of is_prime (plus a few milliseconds to start the processes).
+
+############### Results in shared memory :
+# Each result sent on a SimpleQueue is pickled by the worker, written to a pipe, read and unpickled by the parent.
+# For cheap checks (is_prime_mr takes microseconds), that costs more than the check itself.
+# With multiprocessing.shared_memory, the parent and the workers map the same block of memory: an array of fixed-size
+# records, one per job, indexed by the job id. The parent writes n in each record, the workers read it and write the
+# result in place (struct.pack_into: no object is sent), and the parent reads the array once the workers are joined.
+# Only the job ids go through a queue: a range of ids per chunk, a few bytes whatever the size of the chunk.
+# After the records, one byte per job is set to 1 once its result is written: if a worker raises or is killed in the
+# middle of a chunk, the parent finds the jobs that were never done, instead of returning their records as not prime.
+import struct
+from multiprocessing.shared_memory import SharedMemory
+
+RESULT_RECORD = struct.Struct('<Q?7xd')     # n, prime, (padding), elapsed: 24 bytes, the elapsed time 8-byte aligned
+NUMBER_FIELD = struct.Struct('<Q')
+
+def check_mr(n: int) -> PrimeResult:
+    t0 = time.perf_counter()
+    res = is_prime_mr(n)
+    return PrimeResult(n, res, time.perf_counter() - t0)
+
+class SharedResults:
+    """An array of RESULT_RECORD in shared memory, one per number, then a done flag (a byte) per number"""
+
+    def __init__(self, numbers):
+        numbers = list(numbers)
+        if not all(isinstance(n, int) for n in numbers):
+            raise TypeError('the numbers must be ints')
+        if numbers and (min(numbers) < 0 or max(numbers) >= 1 << 64):
+            raise ValueError('the numbers must be in [0, 2**64)')
+        self.count = len(numbers)
+        self.done_offset = self.count * RESULT_RECORD.size
+        self.shm = SharedMemory(create=True, size=max(self.count * (RESULT_RECORD.size + 1), 1))    # zeroed
+        try:
+            for job, n in enumerate(numbers):
+                RESULT_RECORD.pack_into(self.shm.buf, job * RESULT_RECORD.size, n, False, 0.0)
+        except BaseException:       # the block must not outlive us
+            self.close()
+            raise
+
+    def missing(self) -> int:
+        """The number of jobs whose result has not been written"""
+        return bytes(self.shm.buf[self.done_offset:self.done_offset + self.count]).count(0)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, job: int) -> PrimeResult:
+        if not 0 <= job < self.count:
+            raise IndexError(job)
+        return PrimeResult._make(RESULT_RECORD.unpack_from(self.shm.buf, job * RESULT_RECORD.size))
+
+    def __iter__(self):
+        records = self.shm.buf[:self.count * RESULT_RECORD.size]
+        try:
+            yield from map(PrimeResult._make, RESULT_RECORD.iter_unpack(records))
+        finally:
+            records.release()
+
+    def close(self) -> None:
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def shared_worker(name: str, function, jobs: JobQueue, done_offset: int) -> None:
+    # The children of a process use its resource tracker: the block is registered once, and unlinked by the parent
+    shm = SharedMemory(name=name)
+    buf = shm.buf
+    try:
+        while chunk := jobs.get():      # a range of job ids; an empty range is the poison pill
+            for job in chunk:
+                offset = job * RESULT_RECORD.size
+                n, = NUMBER_FIELD.unpack_from(buf, offset)
+                t0 = time.perf_counter()
+                prime = function(n)
+                RESULT_RECORD.pack_into(buf, offset, n, prime, time.perf_counter() - t0)
+                buf[done_offset + job] = 1
+    finally:
+        buf.release()
+        shm.close()
+
+def check_shared(numbers, function=is_prime_mr, workers: int | None = None, min_chunk: int = 1) -> list[PrimeResult]:
+    """PrimeResult for each number, in order, computed by worker processes that write into shared memory"""
+    workers = workers or cpu_count()
+    with SharedResults(numbers) as results:
+        jobs: JobQueue = SimpleQueue()
+        args = (results.shm.name, function, jobs, results.done_offset)
+        procs = [Process(target=shared_worker, args=args) for _ in range(workers)]
+        for proc in procs:
+            proc.start()
+
+        # A put blocks while the job pipe is full: if all the workers die, it would block forever. The chunks are put by
+        # a (daemon) thread while the parent waits for the workers to exit.
+        def feed() -> None:
+            for chunk in guided_chunks(range(len(results)), workers, min_chunk):
+                jobs.put(chunk)
+            for _ in procs:
+                jobs.put(range(0))      # Poison Pill
+
+        threading.Thread(target=feed, daemon=True).start()
+        for proc in procs:
+            proc.join()             # after the joins, no record can change
+        missing = results.missing()
+        if missing:
+            exitcodes = [proc.exitcode for proc in procs]
+            raise RuntimeError(f'check_shared: {missing} numbers not checked (exit codes of the workers: {exitcodes})')
+        return list(results)
+
+def bench_shared_results(count: int = 1_000_000, workers: int | None = None, seed: int = 0) -> None:
+    """The same checks, results pickled through a pipe (HomegrownPool) versus in shared memory"""
+    workers = workers or cpu_count()
+    rnd = random.Random(seed)
+    numbers = [rnd.randrange(3, 1 << 62) for _ in range(count)]
+
+    t0 = time.perf_counter()
+    expected = [check_mr(n).prime for n in numbers]
+    print(f'sequential, check_mr:            {time.perf_counter() - t0:6.2f}s')
+
+    for label, max_chunk in (('one result per put', 1), ('guided chunks', None)):
+        sample = numbers if max_chunk is None else numbers[:count // 10]
+        t0 = time.perf_counter()
+        with HomegrownPool(check_mr, workers) as pool:
+            primes = {n: prime for n, prime, _ in pool.map_unordered(sample, max_chunk=max_chunk)}
+        elapsed = time.perf_counter() - t0
+        assert [primes[n] for n in sample] == expected[:len(sample)]
+        note = '' if max_chunk is None else f' (x10: measured on {len(sample):,} numbers)'
+        print(f'SimpleQueue, {label:20} {elapsed * count / len(sample):6.2f}s{note}')
+
+    t0 = time.perf_counter()
+    results = check_shared(numbers, is_prime_mr, workers)
+    print(f'shared memory:                   {time.perf_counter() - t0:6.2f}s')
+    assert [result.prime for result in results] == expected
+
+# if __name__ == '__main__':
+#     bench_shared_results()
+# 1,000,000 random 62-bit numbers, 1 worker process (a machine with a single core):
+# sequential, check_mr:              4.21s
+# SimpleQueue, one result per put    32.57s (x10: measured on 100,000 numbers)
+# SimpleQueue, guided chunks          9.64s
+# shared memory:                     5.02s
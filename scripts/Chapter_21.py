@@ -197,6 +197,96 @@ if __name__ == '__main__':
 # # # # # # # # # # # # # # # # # # 
 
 
+# # # # # # # Cost-aware scheduling (Longest Processing Time first) :
+# Sorting NUMBERS in reverse puts 9999999999999999 (divisible by 3, microseconds) first and 142702110479723 (a prime,
+# about a second) last: the size of a number is a poor estimate of the time is_prime takes for it.
+#   - is_prime stops at the smallest divisor, so its cost is about the number of odd candidates below that divisor:
+#     almost nothing when n is even or has a small factor, and √n / 2 divisions otherwise (a prime, or a product of
+#     two large primes: we cannot tell without doing the work).
+#   - Longest Processing Time first: the jobs are taken by decreasing estimated cost, and each one goes to the worker
+#     that has the least work. The biggest jobs are spread first, and the small ones fill the gaps at the end.
+#     Its makespan (the time when the last worker finishes) is at most 4/3 of the optimal one (Graham, 1969).
+# With a pool, "the least loaded worker" is the first one to be free: submitting the jobs in LPT order is enough.
+# lpt_plan computes the same assignment ahead of time, with the estimated costs.
+import heapq
+import math
+import os
+
+from Chapter_20 import PRIME_FIXTURE
+
+SMALL_FACTORS = (3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47)
+
+def is_prime_cost(n: int) -> float:
+    """Estimated number of divisions of is_prime(n)"""
+    if n < 3 or n % 2 == 0:
+        return 1
+    for p in SMALL_FACTORS:
+        if n % p == 0:
+            return p // 2
+    return math.isqrt(n) / 2
+
+def lpt_order(jobs, cost: Callable) -> list:
+    return sorted(jobs, key=cost, reverse=True)
+
+def lpt_plan(jobs, cost: Callable, workers: int) -> list[list]:
+    """Assign each job, by decreasing cost, to the worker with the smallest total cost so far"""
+    loads = [(0, worker) for worker in range(workers)]     # a heap of (load, worker)
+    plan: list[list] = [[] for _ in range(workers)]
+    for job in lpt_order(jobs, cost):
+        load, worker = heapq.heappop(loads)
+        plan[worker].append(job)
+        heapq.heappush(loads, (load + cost(job), worker))
+    return plan
+
+def simulate_makespan(order, cost: Callable, workers: int) -> float:
+    """The makespan of a pool that gives the next job of order to the first free worker"""
+    free_at = [0.0] * workers
+    for job in order:
+        heapq.heapreplace(free_at, free_at[0] + cost(job))
+    return max(free_at)
+
+def run_lpt(executor, function: Callable, jobs, cost: Callable):
+    """Submit the jobs by decreasing cost; yield the results as they complete"""
+    to_do = [executor.submit(function, job) for job in lpt_order(jobs, cost)]
+    for future in futures.as_completed(to_do):
+        yield future.result()
+
+def bench_schedulers(workers: int = 4, simulated_workers=(2, 3, 4, 6, 8)) -> None:
+    """Makespan of FIFO, sorted (reverse) and LPT dispatch on PRIME_FIXTURE, simulated with the measured costs"""
+    numbers = [n for n, _ in PRIME_FIXTURE]
+    measured = {n: elapsed for n, _, elapsed in map(check, numbers)}      # sequential: the real cost of each job
+    orders = {
+        'FIFO': numbers,
+        'sorted(reverse=True)': sorted(numbers, reverse=True),
+        'LPT, estimated costs': lpt_order(numbers, is_prime_cost),
+        'LPT, measured costs': lpt_order(numbers, measured.__getitem__),
+    }
+    total = sum(measured.values())
+    print(f'{len(numbers)} jobs, {total:.2f}s of work. Simulated makespan:')
+    print(f'{"workers":22}' + ''.join(f'{count:8}' for count in simulated_workers))
+    print(f'{"lower bound":22}' + ''.join(f'{max(total / count, max(measured.values())):7.2f}s' for count in simulated_workers))
+    for label, order in orders.items():
+        print(f'{label:22}' + ''.join(f'{simulate_makespan(order, measured.__getitem__, count):7.2f}s' for count in simulated_workers))
+    if (os.cpu_count() or 1) >= workers:
+        for label, order in orders.items():
+            t0 = time.perf_counter()
+            with ProcessPoolExecutor(workers) as executor:
+                list(executor.map(check, order))
+            print(f'{label:22} ProcessPoolExecutor({workers}): {time.perf_counter() - t0:6.2f}s')
+
+# bench_schedulers()     # on a machine with a single core: only the simulation runs
+# 20 jobs, 17.99s of work. Simulated makespan:
+# workers                      2       3       4       6       8
+# lower bound              8.99s   6.00s   4.50s   3.00s   2.25s
+# FIFO                     9.92s   6.83s   5.30s   3.78s   3.41s
+# sorted(reverse=True)     9.27s   6.24s   4.83s   3.30s   3.04s
+# LPT, estimated costs     9.27s   6.24s   4.83s   3.30s   3.04s
+# LPT, measured costs      9.27s   6.28s   4.78s   3.17s   2.94s
+# On this fixture, sorting in reverse is already an LPT order: the cheap jobs (even numbers, small factors) cost
+# nothing wherever they are, and for the others the cost grows with n. The estimator matters when the cost is not
+# monotonic in the value of the job, and lpt_plan gives the expected load of each worker before running anything.
+
+
 # Example to Show that map returns results in the same order of the second argument: 
 
 def mutiplay_by_2(n):
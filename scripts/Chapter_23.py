@@ -27,6 +27,8 @@ print(pointer_to_keys_method_of_dict())                 # dict_keys(['a'])
 # 
 
 from collections import abc
+import operator
+import reprlib
 
 class FrozenJSON:
     """A read-only façade for navigating a JSON-like object
@@ -34,24 +36,65 @@ class FrozenJSON:
     """
     def __init__(self, mapping) -> None:
         self.__data = dict(mapping)
+        self.__children = {}                    # wrappers already built by __getattr__, keyed by attribute name
     
     def __getattr__(self, name: str):           # This method is only invoked as a fallback !
         try:
             return getattr(self.__data, name)   # This why all available methods of dict can be used with FrozenJSON.
         except AttributeError:
             try:
-                return FrozenJSON.build(self.__data[name])
+                return self.__children[name]    # The same path is wrapped only once per instance
+            except KeyError:
+                pass
+            try:
+                child = FrozenJSON.build(self.__data[name])
             except KeyError:
                 raise AttributeError            # because __getattr__ is supposed to return AttributeError and not KeyError !
+            self.__children[name] = child
+            return child
     
     @classmethod
     def build(cls, obj):
         if isinstance(obj, abc.Mapping):        # Example of goose typing
             return cls(obj)
         elif isinstance(obj, abc.MutableSequence):
-            return [cls.build(item) for item in obj]
+            return FrozenJSONList(obj, cls)     # Lazy: items are wrapped only when they are accessed
         return obj
 
+
+class FrozenJSONList(abc.Sequence):
+    """A read-only, lazy sequence proxy over a JSON array:
+       each item is wrapped with build() on first access and then memoized
+    """
+    def __init__(self, items, factory=FrozenJSON) -> None:
+        self.__items = items
+        self.__factory = factory
+        self.__wrapped = {}                     # index -> wrapper
+
+    def __len__(self):
+        return len(self.__items)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return FrozenJSONList(self.__items[index], self.__factory)
+        index = operator.index(index)
+        if index < 0:
+            index += len(self.__items)          # speakers[-1] and speakers[len - 1] share the same wrapper
+        try:
+            return self.__wrapped[index]
+        except KeyError:
+            pass
+        if not 0 <= index < len(self.__items):
+            raise IndexError('FrozenJSONList index out of range')
+        item = self.__wrapped[index] = self.__factory.build(self.__items[index])
+        return item
+
+    def __repr__(self) -> str:
+        return f'FrozenJSONList({reprlib.repr(self.__items)})'
+
+# FrozenJSONList is a Sequence (thanks to abc.Sequence we get for free: __iter__, __contains__, __reversed__, index and count),
+# but it's not a list: feed.Schedule.speakers == [...] is False. Use list(feed.Schedule.speakers) when a real list is needed.
+
 # Test :
 """
 from pathlib import Path
@@ -66,6 +109,11 @@ frozenjson = FrozenJSON(json_data)
 print(frozenjson.Schedule.speakers[-1].name)            # Robert Lefkowitz
 print(frozenjson.keys())                                # dict_keys(['Schedule'])
 
+speakers = frozenjson.Schedule.speakers
+print(speakers)                                         # FrozenJSONList([{'affiliation': 'Sharewave', 'bio': 'Robert ´r0ml... a startup...', 'name': 'Robert Lefkowitz', 'photo': None, ...}])
+print(speakers is frozenjson.Schedule.speakers)         # True  - the child wrapper is memoized
+print(speakers[-1] is speakers[0])                      # True
+
 """
 ############## The Invalid Attribute Name Problem:
 # In the prevouis example, we generate attributes of a FrozenJSON object dynamically using the json data.
@@ -130,6 +178,1035 @@ print(r.a)          # 100
 """
 
 
+############## Streaming a huge JSON feed :
+# 
+# json.load(open(PATH)) materializes the whole document before we can read anything. For a multi-GB feed with the same shape as
+# osconfeed.json (Schedule -> events / speakers / venues), we want to read the file chunk by chunk and get the records one at a time.
+# 
+# The idea (like the ijson library):
+#   - The parser walks the document and yields events: (prefix, event, value), ex: ('Schedule', 'map_key', 'events').
+#   - The prefix is the path of the current value. Items of an array get the prefix of the array + '.item'.
+#   - The arrays we select (ex: 'Schedule.events') are not walked: each of their items is decoded in one go with 
+#     json.JSONDecoder.raw_decode (C speed) and reported as a single 'record' event.
+#   - Only the current chunk and the current record are in memory ==> bounded memory, whatever the size of the file.
+# 
+import json
+import re
+
+JSON_WS = re.compile(r'[ \t\n\r]*')
+NUMBER_TAIL = set('0123456789.eE+-') | {''}     # chars that may continue a number ('' means end of the buffer)
+
+class JSONEventParser:
+    """Event-driven JSON parser reading a text file chunk by chunk"""
+
+    def __init__(self, fp, chunk_size: int = 64 * 1024) -> None:
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self, size=None) -> bool:
+        """Append the next chunk to the buffer (dropping the consumed part). Return False at the end of the file"""
+        if self.eof:
+            return False
+        chunk = self.fp.read(size or self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def _peek(self) -> str:
+        """Skip whitespaces and return the next char without consuming it ('' at the end of the file)"""
+        while True:
+            self.pos = JSON_WS.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or not self._fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def _next_char(self) -> str:
+        char = self._peek()
+        self.pos += 1
+        return char
+
+    def _error(self, msg: str):
+        return json.JSONDecodeError(msg, self.buffer, self.pos)
+
+    def _decode_value(self):
+        """Decode the complete value (scalar, object or array) starting at the current position"""
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self._fill(max(self.chunk_size, len(self.buffer))):   # The value is truncated: read more text and retry
+                    continue
+                raise
+            if self.buffer[end:end + 1] in NUMBER_TAIL and self._fill():  # 12 or 3. at the end of the buffer may be the beginning of 12345 or 3.25
+                continue
+            self.pos = end
+            return value
+
+    def parse(self, select=()):
+        """Yield (prefix, event, value) for the whole document.
+           Items of the arrays whose prefix is in select are yielded as (prefix, 'record', item)
+        """
+        yield from self._parse_value('', frozenset(select))
+        if self._peek():
+            raise self._error('Extra data')
+
+    def _parse_value(self, prefix: str, select):
+        char = self._peek()
+        if char == '{':
+            self.pos += 1
+            yield prefix, 'start_map', None
+            if self._peek() == '}':
+                self.pos += 1
+            else:
+                while True:
+                    if self._peek() != '"':
+                        raise self._error('Expecting property name enclosed in double quotes')
+                    key = self._decode_value()
+                    if self._next_char() != ':':
+                        raise self._error("Expecting ':' delimiter")
+                    yield prefix, 'map_key', key
+                    yield from self._parse_value(f'{prefix}.{key}' if prefix else key, select)
+                    char = self._next_char()
+                    if char == '}':
+                        break
+                    if char != ',':
+                        raise self._error("Expecting ',' delimiter")
+            yield prefix, 'end_map', None
+        elif char == '[':
+            self.pos += 1
+            yield prefix, 'start_array', None
+            if self._peek() == ']':
+                self.pos += 1
+            else:
+                item_prefix = f'{prefix}.item' if prefix else 'item'
+                while True:
+                    if prefix in select:
+                        yield prefix, 'record', self._decode_value()
+                    else:
+                        yield from self._parse_value(item_prefix, select)
+                    char = self._next_char()
+                    if char == ']':
+                        break
+                    if char != ',':
+                        raise self._error("Expecting ',' delimiter")
+            yield prefix, 'end_array', None
+        elif char == '':
+            raise self._error('Unexpected end of JSON input')
+        else:
+            value = self._decode_value()
+            if value is None:
+                event = 'null'
+            elif isinstance(value, bool):
+                event = 'boolean'
+            elif isinstance(value, str):
+                event = 'string'
+            else:
+                event = 'number'
+            yield prefix, event, value
+
+
+def iter_records(fp, *prefixes: str, factory=None, chunk_size: int = 64 * 1024):
+    """Yield (prefix, record) for each item of the selected arrays, ex: iter_records(fp, 'Schedule.events')
+       factory (ex: FrozenJSON or lambda d: Record(**d)) is applied to each record
+    """
+    parser = JSONEventParser(fp, chunk_size)
+    for prefix, event, value in parser.parse(select=prefixes):
+        if event == 'record':
+            yield prefix, (value if factory is None else factory(value))
+
+# Test :
+"""
+from pathlib import Path
+PATH = Path(__file__).parent / "osconfeed.json"
+
+with open(PATH, encoding='utf8') as fp:
+    for prefix, event, value in JSONEventParser(fp).parse():
+        print(prefix, event, value)
+# start_map None
+#  map_key Schedule
+# Schedule start_map None
+# Schedule map_key conferences
+# Schedule.conferences start_array None
+# Schedule.conferences.item start_map None
+# Schedule.conferences.item map_key serial
+# Schedule.conferences.item.serial number 115
+# ...
+
+with open(PATH, encoding='utf8') as fp:
+    for prefix, event in iter_records(fp, 'Schedule.events', factory=FrozenJSON):
+        print(prefix, event.serial, event.venue_serial)     # Schedule.events 34505 1462
+
+with open(PATH, encoding='utf8') as fp:
+    records = iter_records(fp, 'Schedule.speakers', 'Schedule.venues', factory=lambda d: Record(**d))
+    for prefix, record in records:
+        print(prefix, record.name)
+# Schedule.speakers Robert Lefkowitz
+# Schedule.venues F151
+"""
+
+# To try the parser on a feed of a realistic size, we can generate one with the same shape as osconfeed.json:
+import random
+import time
+import tracemalloc
+
+def write_big_feed(path, events: int = 100_000, speakers: int = 10_000, venues: int = 100, seed: int = 0) -> None:
+    """Write a synthetic feed with the shape of osconfeed.json (one record per line)"""
+    rnd = random.Random(seed)
+    first_event, first_speaker, first_venue = 30_000, 150_000, 1_400
+    with open(path, 'w', encoding='utf8') as fp:
+        fp.write('{ "Schedule": \n  { "conferences": [{"serial": 115 }],\n    "events": [\n')
+        for i in range(events):
+            sep = ',\n' if i else ''
+            fp.write(sep + json.dumps({
+                'serial': first_event + i,
+                'name': f'Talk number {i}',
+                'event_type': '40-minute conference session',
+                'time_start': '2014-07-23 11:30:00',
+                'time_stop': '2014-07-23 12:10:00',
+                'venue_serial': first_venue + rnd.randrange(venues),
+                'description': 'Aside from the fact that high school programming...',
+                'website_url': f'http://oscon.com/oscon2014/public/schedule/detail/{first_event + i}',
+                'speakers': [first_speaker + rnd.randrange(speakers) for _ in range(rnd.randint(1, 3))],
+                'categories': ['Education'],
+            }, ensure_ascii=False))
+        fp.write('\n    ],\n    "speakers": [\n')
+        for i in range(speakers):
+            sep = ',\n' if i else ''
+            fp.write(sep + json.dumps({
+                'serial': first_speaker + i,
+                'name': f'Speaker {i}',
+                'photo': None,
+                'url': 'http://sharewave.com/',
+                'position': 'CTO',
+                'affiliation': 'Sharewave',
+                'twitter': 'sharewaveteam',
+                'bio': 'Robert ´r0ml´ Lefkowitz is the CTO at Sharewave, a startup...',
+            }, ensure_ascii=False))
+        fp.write('\n    ],\n    "venues": [\n')
+        for i in range(venues):
+            sep = ',\n' if i else ''
+            fp.write(sep + json.dumps({'serial': first_venue + i, 'name': f'F{i}', 'category': 'Conference Venues'}))
+        fp.write('\n    ]\n  }\n}\n')
+
+
+def bench_streaming(path) -> None:
+    """Compare time and peak memory of json.load and iter_records over the same feed"""
+    def measure(label, func):
+        t0 = time.perf_counter()
+        count = func()
+        elapsed = time.perf_counter() - t0
+        tracemalloc.start()                     # A second run for the memory: tracemalloc slows down the allocations a lot
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f'{label:12} {count:9} events {elapsed:8.2f}s  peak: {peak / 2**20:8.1f} MiB')
+
+    def load_all():
+        with open(path, encoding='utf8') as fp:
+            return len(json.load(fp)['Schedule']['events'])
+
+    def stream():
+        with open(path, encoding='utf8') as fp:
+            return sum(1 for _ in iter_records(fp, 'Schedule.events'))
+
+    measure('json.load', load_all)
+    measure('iter_records', stream)
+
+# Test :
+"""
+write_big_feed('/tmp/bigfeed.json', events=200_000)     # ~ 80 MB
+bench_streaming('/tmp/bigfeed.json')
+# json.load       200000 events     1.51s  peak:    296.3 MiB
+# iter_records    200000 events     0.81s  peak:      0.6 MiB     # The peak memory does not depend on the size of the file
+# The times vary from one run (and one machine) to another, down to about the same for both (1.27s vs 1.24s on
+# another run): the gain of iter_records is the peak memory, not the speed.
+"""
+
+
+############## Linking records: a Schedule indexed by serial number :
+# 
+# In osconfeed.json, the records are linked by serial numbers:
+#   - an event points to its venue with 'venue_serial': 1462
+#   - an event points to its speakers with 'speakers': [157509]
+# Resolving them by scanning the speakers/venues lists for each event is quadratic. Instead, we build once, at load time, 
+# one dict per collection keyed by serial. Then each join is a O(1) lookup, and it's cached in the event.
+# 
+from functools import cached_property
+
+class ScheduleRecord(Record):
+    """A Record that knows the Schedule it belongs to (to resolve its links)"""
+    def __init__(self, schedule, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self._schedule = schedule
+
+    def __repr__(self) -> str:
+        return f'<{self.__class__.__name__} serial={self.serial!r}>'
+
+
+class Event(ScheduleRecord):
+    def __repr__(self) -> str:
+        return f'<Event {self.name!r}>'
+
+    @cached_property                            # computed on the first access, then stored in the instance __dict__ under 'venue'
+    def venue(self):
+        return self._schedule.venues[self.venue_serial]
+
+    @property
+    def speakers(self):
+        # 'speakers' is already a key of the instance __dict__ (the list of serials), so a cached_property would be shadowed by it.
+        # A property is a data descriptor: it has precedence over the instance __dict__, so we cache the join under another key.
+        try:
+            return self.__dict__['_speaker_records']
+        except KeyError:
+            index = self._schedule.speakers
+            speakers = [index[serial] for serial in self.__dict__.get('speakers', [])]    # some events have no speakers
+            self.__dict__['_speaker_records'] = speakers
+            return speakers
+
+
+class Schedule:
+    """The records of a feed, indexed by serial number: schedule.events[34505] or schedule.fetch('event.34505')"""
+    record_classes = {'events': Event}          # The other collections use ScheduleRecord
+
+    def __init__(self) -> None:
+        self.conferences: dict[int, ScheduleRecord] = {}
+        self.events: dict[int, Event] = {}
+        self.speakers: dict[int, ScheduleRecord] = {}
+        self.venues: dict[int, ScheduleRecord] = {}
+
+    @classmethod
+    def load(cls, json_data) -> 'Schedule':
+        schedule = cls()
+        for collection, records in json_data['Schedule'].items():
+            for record in records:
+                schedule.add(collection, record)
+        return schedule
+
+    @classmethod
+    def from_stream(cls, fp) -> 'Schedule':
+        """Build the indexes from a file without loading the whole document (see iter_records)"""
+        schedule = cls()
+        prefixes = [f'Schedule.{collection}' for collection in vars(schedule)]
+        for prefix, record in iter_records(fp, *prefixes):
+            schedule.add(prefix.rpartition('.')[2], record)
+        return schedule
+
+    def add(self, collection: str, record) -> ScheduleRecord:
+        cls = self.record_classes.get(collection, ScheduleRecord)
+        obj = cls(self, **record)
+        vars(self).setdefault(collection, {})[obj.serial] = obj
+        return obj
+
+    def fetch(self, key: str) -> ScheduleRecord:
+        """Return the record for a key like 'event.34505'"""
+        kind, _, serial = key.partition('.')
+        return getattr(self, kind + 's')[int(serial)]
+
+# Test :
+"""
+from pathlib import Path
+PATH = Path(__file__).parent / "osconfeed.json"
+
+schedule = Schedule.load(json.load(open(PATH, encoding='utf8')))
+event = schedule.events[34505]
+print(event)                    # <Event 'Why Schools Don´t Use Open Source to Teach Programming'>
+print(event.venue)              # <ScheduleRecord serial=1462>
+print(event.venue.name)         # F151
+print(event.speakers)           # [<ScheduleRecord serial=157509>]
+print(event.speakers[0].name)   # Robert Lefkowitz
+print(event.speakers is event.speakers)             # True  - the join is computed once
+print(schedule.fetch('speaker.157509').twitter)     # sharewaveteam
+
+with open(PATH, encoding='utf8') as fp:
+    print(Schedule.from_stream(fp).fetch('event.34505').venue.name)     # F151
+"""
+
+def render(schedule: Schedule) -> list[str]:
+    return [
+        f'{event.time_start} {event.venue.name:6} {event.name} ({", ".join(s.name for s in event.speakers)})'
+        for event in schedule.events.values()
+    ]
+
+def render_with_scans(json_data) -> list[str]:
+    """The same report, resolving the links by scanning the lists (the quadratic way)"""
+    feed = json_data['Schedule']
+    lines = []
+    for event in feed['events']:
+        venue = next(v for v in feed['venues'] if v['serial'] == event['venue_serial'])
+        speakers = [s for serial in event['speakers'] for s in feed['speakers'] if s['serial'] == serial]
+        lines.append(f'{event["time_start"]} {venue["name"]:6} {event["name"]} ({", ".join(s["name"] for s in speakers)})')
+    return lines
+
+def bench_render(path) -> None:
+    with open(path, encoding='utf8') as fp:
+        json_data = json.load(fp)
+    t0 = time.perf_counter()
+    expected = render_with_scans(json_data)
+    print(f'linear scans: {time.perf_counter() - t0:8.3f}s')
+    t0 = time.perf_counter()
+    schedule = Schedule.load(json_data)
+    lines = render(schedule)
+    print(f'indexes:      {time.perf_counter() - t0:8.3f}s  (load + render)')
+    assert lines == expected
+
+# Test :
+"""
+write_big_feed('/tmp/feed10k.json', events=10_000, speakers=2_000)
+bench_render('/tmp/feed10k.json')
+# linear scans:    1.400s
+# indexes:         0.101s  (load + render)
+"""
+
+
+############## A persistent record store for the feed :
+# 
+# Every run re-parses the whole feed. We can convert it once into two files:
+#   - feed.store      : one record per line (compact JSON)
+#   - feed.store.idx  : an index of fixed-size entries (kind, serial, offset, length), sorted by (kind, serial)
+# The keys are like 'event.34505' (kind = collection name without the final 's').
+# Opening the store only maps the two files in memory (mmap): no parsing at all, so it's near-instant whatever the size of the feed.
+# A record is found with a binary search over the index, and decoded only when it is accessed.
+# 
+import bisect
+import mmap
+import struct
+
+class RecordStore(abc.Mapping):
+    """Read-only mapping 'event.34505' -> record, backed by memory-mapped files"""
+    MAGIC = b'RECSTORE1\n'
+    ENTRY = struct.Struct('<HqQI')              # kind id, serial, offset, length
+
+    def __init__(self, path, factory=FrozenJSON) -> None:
+        self.factory = factory
+        self._files = []
+        self._data = self._index = b''
+        try:
+            self._files.append(open(path, 'rb'))
+            self._files.append(open(f'{path}.idx', 'rb'))
+            self._data = self._map(self._files[0])
+            self._index = self._map(self._files[1])
+            if self._index[:len(self.MAGIC)] != self.MAGIC:
+                raise ValueError(f'{path}.idx is not a record store index')
+            header_len = int.from_bytes(self._index[len(self.MAGIC):len(self.MAGIC) + 4], 'little')
+            self._entries_start = len(self.MAGIC) + 4 + header_len
+            self.kinds: list[str] = json.loads(self._index[len(self.MAGIC) + 4:self._entries_start])
+        except BaseException:
+            self.close()                        # don't leak what was already opened or mapped
+            raise
+        self._kind_ids = {kind: i for i, kind in enumerate(self.kinds)}
+        self._count = (len(self._index) - self._entries_start) // self.ENTRY.size
+
+    @staticmethod
+    def _map(fp):
+        if fp.seek(0, 2) == 0:
+            return b''                          # An empty file can't be mapped
+        return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @classmethod
+    def build(cls, json_path, path) -> None:
+        """Convert a feed with the shape of osconfeed.json (streamed with iter_records) into a store"""
+        prefixes = [f'Schedule.{collection}' for collection in vars(Schedule())]
+        kinds: list[str] = []
+        kind_ids: dict[str, int] = {}
+        entries = []
+        with open(json_path, encoding='utf8') as fp, open(path, 'wb') as out:
+            offset = 0
+            for prefix, record in iter_records(fp, *prefixes):
+                kind = prefix.rpartition('.')[2].removesuffix('s')
+                if kind not in kind_ids:
+                    kind_ids[kind] = len(kinds)
+                    kinds.append(kind)
+                line = json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf8') + b'\n'
+                out.write(line)
+                entries.append((kind_ids[kind], record['serial'], offset, len(line) - 1))
+                offset += len(line)
+        entries.sort()
+        header = json.dumps(kinds).encode('utf8')
+        with open(f'{path}.idx', 'wb') as out:
+            out.write(cls.MAGIC + len(header).to_bytes(4, 'little') + header)
+            out.writelines(cls.ENTRY.pack(*entry) for entry in entries)
+
+    def _entry(self, i: int) -> tuple:
+        return self.ENTRY.unpack_from(self._index, self._entries_start + i * self.ENTRY.size)
+
+    def _locate(self, key: str):
+        if not isinstance(key, str):        # store[123], 5 in store: a missing key, as for a dict
+            raise KeyError(key)
+        kind, _, serial = key.partition('.')
+        try:
+            target = (self._kind_ids[kind], int(serial))
+        except (KeyError, ValueError):
+            raise KeyError(key) from None
+        i = bisect.bisect_left(range(self._count), target, key=lambda i: self._entry(i)[:2])
+        if i < self._count:
+            kind_id, serial, offset, length = self._entry(i)
+            if (kind_id, serial) == target:
+                return offset, length
+        raise KeyError(key)
+
+    def __getitem__(self, key: str):
+        offset, length = self._locate(key)
+        return self.factory(json.loads(self._data[offset:offset + length]))
+
+    def __contains__(self, key) -> bool:
+        try:
+            self._locate(key)
+        except KeyError:
+            return False
+        return True
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self):
+        for i in range(self._count):
+            kind_id, serial, _, _ = self._entry(i)
+            yield f'{self.kinds[kind_id]}.{serial}'
+
+    def close(self) -> None:
+        for mapped in (self._data, self._index):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+        for fp in self._files:
+            fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+# Test :
+"""
+RecordStore.build(Path(__file__).parent / "osconfeed.json", '/tmp/osconfeed.store')
+with RecordStore('/tmp/osconfeed.store') as store:
+    print(list(store))                      # ['conference.115', 'event.34505', 'speaker.157509', 'venue.1462']
+    print(store['event.34505'].name)        # Why Schools Don´t Use Open Source to Teach Programming
+    print('venue.1462' in store)            # True
+
+with RecordStore('/tmp/osconfeed.store', factory=lambda d: Record(**d)) as store:
+    print(vars(store['venue.1462']))        # {'serial': 1462, 'name': 'F151', 'category': 'Conference Venues'}
+"""
+
+def bench_store(json_path, path, key: str = 'event.34505') -> None:
+    """Time to get one record: full json.load versus opening the store"""
+    t0 = time.perf_counter()
+    RecordStore.build(json_path, path)
+    print(f'build store (once): {time.perf_counter() - t0:9.4f}s')
+
+    t0 = time.perf_counter()
+    with open(json_path, encoding='utf8') as fp:
+        feed = FrozenJSON(json.load(fp))
+    kind, _, serial = key.partition('.')
+    name = next(r.name for r in getattr(feed.Schedule, kind + 's') if r.serial == int(serial))
+    print(f'json.load + lookup: {time.perf_counter() - t0:9.4f}s')
+
+    t0 = time.perf_counter()
+    with RecordStore(path) as store:
+        assert store[key].name == name
+    print(f'store open + lookup:{time.perf_counter() - t0:9.4f}s')
+
+# Test :
+"""
+write_big_feed('/tmp/bigfeed.json', events=200_000)
+bench_store('/tmp/bigfeed.json', '/tmp/bigfeed.store', 'event.34505')
+# build store (once):    3.5268s
+# json.load + lookup:    4.2103s
+# store open + lookup:   0.0004s
+"""
+
+
+############## Compact records: __slots__ classes inferred from the data :
+# 
+# Record stores its attributes in a per-instance __dict__, and FrozenJSON wraps a whole dict (plus the cache of its children). With
+# millions of events, those dicts take most of the memory. All the records of a collection have (almost) the same keys, so we can:
+#   1. infer the schema of a collection: the union of its keys, in order of first appearance
+#   2. build a class with __slots__ for it, with type() like record_factory in Chapter 25
+#   3. load the records in instances of that class: no __dict__ per instance, only a fixed array of references.
+# A key that is not a valid attribute name gets the same treatment as in FrozenJSON_V1: 'class' -> 'class_'.
+# So does a key that would clash with an attribute of the generated class ('from_json' -> 'from_json_'), and a key
+# starting with '__', which would be name-mangled (or be a special method) in a class body: '__id' -> '_id_'.
+# 
+RESERVED_NAMES = frozenset({'from_json', '_asdict', '_schema'})
+
+def attr_name(key: str) -> str:
+    name = re.sub(r'\W', '_', key)
+    if not name or name[0].isdigit():
+        name = '_' + name
+    if name.startswith('__'):
+        name = f"_{name.lstrip('_')}_"
+    if keyword.iskeyword(name) or name in RESERVED_NAMES:
+        name += '_'
+    return name
+
+def infer_schema(records) -> dict[str, str]:
+    """Map each key found in the records to its attribute name"""
+    schema: dict[str, str] = {}
+    for record in records:
+        for key in record:
+            if key not in schema:
+                name = attr_name(key)
+                while name in schema.values():  # 'a-b' and 'a_b' can't share the same slot
+                    name += '_'
+                schema[key] = name
+    return schema
+
+def slotted_record_factory(cls_name: str, schema: dict[str, str]) -> type:
+    keys = tuple(schema)
+    slots = tuple(schema.values())
+
+    def __init__(self, /, *args, **kwargs) -> None:      # self positional-only: a field can be named 'self'
+        for name, value in zip(slots, args):
+            setattr(self, name, value)
+        for name in slots[len(args):]:
+            setattr(self, name, kwargs.pop(name, None))     # A missing key is None
+        if kwargs:
+            raise TypeError(f'{cls_name}() got unexpected fields: {", ".join(kwargs)}')
+
+    def from_json(cls, record):
+        return cls(*map(record.get, keys))
+
+    def __iter__(self):
+        for name in slots:
+            yield getattr(self, name)
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return tuple(self) == tuple(other)
+
+    def __repr__(self) -> str:
+        values = ', '.join(f'{name}={value!r}' for name, value in zip(slots, self))
+        return f'{cls_name}({values})'
+
+    def _asdict(self) -> dict:
+        return dict(zip(keys, self))            # With the original JSON keys
+
+    cls_attrs = dict(
+        __slots__=slots,
+        __init__=__init__,
+        from_json=classmethod(from_json),
+        __iter__=__iter__,
+        __eq__=__eq__,
+        __repr__=__repr__,
+        _asdict=_asdict,
+        _schema=dict(schema),
+    )
+    return type(cls_name, (object,), cls_attrs)
+
+def load_slotted(json_data) -> dict[str, list]:
+    """Load each collection of the feed in its own inferred __slots__ class"""
+    loaded = {}
+    for collection, records in json_data['Schedule'].items():
+        cls = slotted_record_factory(collection.removesuffix('s').capitalize(), infer_schema(records))
+        loaded[collection] = [cls.from_json(record) for record in records]
+    return loaded
+
+# Test :
+"""
+from pathlib import Path
+PATH = Path(__file__).parent / "osconfeed.json"
+
+feed = load_slotted(json.load(open(PATH, encoding='utf8')))
+venue = feed['venues'][0]
+print(venue)                    # Venue(serial=1462, name='F151', category='Conference Venues')
+print(venue.__slots__)          # ('serial', 'name', 'category')
+print(hasattr(venue, '__dict__'))   # False
+
+Klass = slotted_record_factory('Klass', infer_schema([{'class': 'A', 'time-start': 1}]))
+k = Klass.from_json({'class': 'A'})
+print(k)                        # Klass(class_='A', time_start=None)
+print(k._asdict())              # {'class': 'A', 'time-start': None}
+"""
+
+def bench_record_memory(path, collection: str = 'events') -> None:
+    """Memory per record (only the wrappers: the values are shared) for Record, FrozenJSON and the inferred __slots__ class"""
+    with open(path, encoding='utf8') as fp:
+        records = json.load(fp)['Schedule'][collection]
+    slotted_cls = slotted_record_factory('Slotted', infer_schema(records))
+    builders = [
+        ('Record', lambda r: Record(**r)),
+        ('FrozenJSON', FrozenJSON),
+        ('__slots__', slotted_cls.from_json),
+    ]
+    sizes = {}
+    for label, build in builders:
+        tracemalloc.start()
+        objects = [build(record) for record in records]
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del objects
+        sizes[label] = size / len(records)
+    for label, size in sizes.items():
+        print(f'{label:10} {size:7.1f} bytes/record  ({size / sizes["__slots__"]:.1f}x __slots__)')
+
+# Test :
+"""
+write_big_feed('/tmp/feed100k.json', events=100_000)
+bench_record_memory('/tmp/feed100k.json')
+# Record       336.0 bytes/record  (2.8x __slots__)
+# FrozenJSON   432.0 bytes/record  (3.6x __slots__)
+# __slots__    120.0 bytes/record  (1.0x __slots__)
+# 
+# An event with __slots__ is: GC header + object header + 10 references (+ 8 bytes for its pointer in the list).
+# A Record is the object (56 bytes) + its __dict__ with 10 keys (272 bytes), and FrozenJSON adds the dict of its children.
+"""
+
+
+############## Compiled path queries :
+# 
+# frozenjson.Schedule.speakers[-1].name goes through __getattr__ and build() at every step. For queries that run again and again 
+# (dashboards), we can compile a path once into a chain of closures that work directly on the raw dicts and lists:
+# 
+#   Schedule.events[?venue_serial==1462].name
+# 
+#   - name              : value of the key in a dict
+#   - [2], [-1]         : item of a list
+#   - [*]               : every item of a list (or every value of a dict)
+#   - [?field op value] : items of a list for which the test is true. op: == != < <= > >=, value: number, 'string', true, false, null
+#   - [?field]          : items of a list that have this field. The field can be a path too: [?venue.name=='F151']
+# 
+# Each step is a generator function that takes an iterator of nodes and yields nodes, so the result is a lazy iterator.
+# 
+import functools
+
+QUERY_TOKEN = re.compile(r'''\s*(?:
+     (?P<number>-?\d+(?:\.\d+)?)
+    |(?P<string>"[^"]*"|'[^']*')
+    |(?P<op>==|!=|<=|>=|<|>)
+    |(?P<name>[^\W\d]\w*)
+    |(?P<punct>[.\[\]?*])
+)''', re.VERBOSE)
+
+QUERY_OPS = {'==': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+QUERY_CONSTANTS = {'true': True, 'false': False, 'null': None}
+MISSING = object()
+
+class QuerySyntaxError(ValueError):
+    """Raised when a path query can't be parsed"""
+
+
+def tokenize_query(query: str) -> list[tuple[str, str]]:
+    tokens = []
+    pos = 0
+    query = query.rstrip()
+    while pos < len(query):
+        match = QUERY_TOKEN.match(query, pos)
+        if match is None:
+            raise QuerySyntaxError(f'Unexpected {query[pos:]!r} in {query!r}')
+        tokens.append((match.lastgroup, match.group(match.lastgroup)))
+        pos = match.end()
+    return tokens
+
+
+def key_step(name):
+    def step(nodes):
+        for node in nodes:
+            if isinstance(node, dict) and name in node:
+                yield node[name]
+    return step
+
+def index_step(index):
+    def step(nodes):
+        for node in nodes:
+            if isinstance(node, list):
+                try:
+                    yield node[index]
+                except IndexError:
+                    pass
+    return step
+
+def wildcard_step(nodes):
+    for node in nodes:
+        if isinstance(node, list):
+            yield from node
+        elif isinstance(node, dict):
+            yield from node.values()
+
+def filter_step(test):
+    def step(nodes):
+        for node in nodes:
+            if isinstance(node, list):
+                yield from filter(test, node)   # filter() is implemented in C
+    return step
+
+def field_getter(names):
+    def get(item):
+        for name in names:
+            if not isinstance(item, dict):
+                return MISSING
+            item = item.get(name, MISSING)
+        return item
+    return get
+
+def make_test(names, op=None, value=None):
+    get = field_getter(names)
+    if op is None:
+        return lambda item: get(item) is not MISSING
+    def test(item):
+        field = get(item)
+        if field is MISSING:
+            return False
+        try:
+            return op(field, value)
+        except TypeError:                       # ex: 'F151' < 3
+            return False
+    return test
+
+
+class QueryParser:
+    def __init__(self, query: str) -> None:
+        self.query = query
+        self.tokens = tokenize_query(query)
+        self.pos = 0
+
+    def error(self, expected: str) -> QuerySyntaxError:
+        found = self.tokens[self.pos][1] if self.pos < len(self.tokens) else 'end of query'
+        return QuerySyntaxError(f'Expecting {expected}, found {found!r} in {self.query!r}')
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self, kind: str, value=None) -> str:
+        token_kind, token_value = self.peek()
+        if token_kind != kind or (value is not None and token_value != value):
+            raise self.error(repr(value) if value else kind)
+        self.pos += 1
+        return token_value
+
+    def parse(self) -> list:
+        steps = []
+        while True:
+            if self.peek()[0] == 'name':
+                steps.append(key_step(self.take('name')))
+            elif self.peek() != ('punct', '['):
+                raise self.error('a name or [')
+            while self.peek() == ('punct', '['):
+                steps.append(self.parse_bracket())
+            if self.peek() == (None, None):
+                return steps
+            self.take('punct', '.')
+
+    def parse_field(self) -> list[str]:
+        names = [self.take('name')]
+        while self.peek() == ('punct', '.'):
+            self.pos += 1
+            names.append(self.take('name'))
+        return names
+
+    def parse_literal(self):
+        kind, value = self.peek()
+        self.pos += 1
+        if kind == 'number':
+            return float(value) if '.' in value else int(value)
+        if kind == 'string':
+            return value[1:-1]
+        if kind == 'name' and value in QUERY_CONSTANTS:
+            return QUERY_CONSTANTS[value]
+        self.pos -= 1
+        raise self.error('a number, a string, true, false or null')
+
+    def parse_bracket(self):
+        self.take('punct', '[')
+        kind, value = self.peek()
+        if kind == 'number' and '.' not in value:
+            self.pos += 1
+            step = index_step(int(value))
+        elif (kind, value) == ('punct', '*'):
+            self.pos += 1
+            step = wildcard_step
+        elif (kind, value) == ('punct', '?'):
+            self.pos += 1
+            names = self.parse_field()
+            if self.peek()[0] == 'op':
+                op = QUERY_OPS[self.take('op')]
+                step = filter_step(make_test(names, op, self.parse_literal()))
+            else:
+                step = filter_step(make_test(names))
+        else:
+            raise self.error('an index, * or ?')
+        self.take('punct', ']')
+        return step
+
+
+@functools.lru_cache(maxsize=256)
+def compile_query(query: str):
+    """Compile a path query once. Return a function: data -> lazy iterator of the matching values"""
+    steps = QueryParser(query).parse()
+
+    def run(data):
+        if isinstance(data, FrozenJSON):        # Work on the raw data of the façade (name mangling: __data -> _FrozenJSON__data)
+            data = data._FrozenJSON__data
+        elif isinstance(data, FrozenJSONList):
+            data = data._FrozenJSONList__items
+        nodes = iter((data,))
+        for step in steps:
+            nodes = step(nodes)
+        return nodes
+    return run
+
+def query(data, path: str):
+    return compile_query(path)(data)
+
+# Test :
+"""
+from pathlib import Path
+PATH = Path(__file__).parent / "osconfeed.json"
+json_data = json.load(open(PATH, encoding='utf8'))
+
+print(list(query(json_data, 'Schedule.events[?venue_serial==1462].name')))   # ['Why Schools Don´t Use Open Source to Teach Programming']
+print(list(query(json_data, 'Schedule.speakers[-1].name')))                   # ['Robert Lefkowitz']
+print(list(query(json_data, 'Schedule[*][*].serial')))                        # [115, 34505, 157509, 1462]
+print(list(query(json_data, "Schedule.venues[?category=='Keynotes'].name")))  # []
+print(list(query(json_data, 'Schedule.speakers[?photo==null].twitter')))      # ['sharewaveteam']
+
+by_venue = compile_query('Schedule.events[?venue_serial==1462].name')        # compiled once, run many times
+print(next(by_venue(FrozenJSON(json_data))))                                 # Why Schools Don´t Use Open Source to Teach Programming
+
+# query(json_data, 'Schedule..name')     # QuerySyntaxError: Expecting a name or [, found '.' in 'Schedule..name'
+"""
+
+def bench_query(path, repeat: int = 100) -> None:
+    """The same queries with FrozenJSON attributes and with compiled queries"""
+    with open(path, encoding='utf8') as fp:
+        json_data = json.load(fp)
+    feed = FrozenJSON(json_data)
+    venue_serial = json_data['Schedule']['venues'][0]['serial']
+
+    def measure(label, func, repeat):
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        print(f'{label:40} {(time.perf_counter() - t0) / repeat * 1e3:9.4f}ms per query')
+
+    measure('FrozenJSON: Schedule.speakers[-1].name', lambda: feed.Schedule.speakers[-1].name, repeat * 1000)
+    last_speaker = compile_query('Schedule.speakers[-1].name')
+    measure('query: Schedule.speakers[-1].name', lambda: next(last_speaker(json_data)), repeat * 1000)
+
+    measure('FrozenJSON: events of a venue',
+            lambda: [event.name for event in feed.Schedule.events if event.venue_serial == venue_serial], repeat)
+    by_venue = compile_query(f'Schedule.events[?venue_serial=={venue_serial}].name')
+    measure('query: events of a venue', lambda: list(by_venue(json_data)), repeat)
+
+# Test :
+"""
+write_big_feed('/tmp/feed10k.json', events=10_000, speakers=2_000)
+bench_query('/tmp/feed10k.json')
+# FrozenJSON: Schedule.speakers[-1].name      0.0037ms per query     # (the wrappers are memoized: see FrozenJSON)
+# query: Schedule.speakers[-1].name           0.0025ms per query
+# FrozenJSON: events of a venue              16.8096ms per query
+# query: events of a venue                    2.8956ms per query
+"""
+
+
+############## Caching the parsed feed for a fast startup :
+# 
+# Most of the startup time of a script that loads osconfeed.json is spent decoding the JSON and building the objects.
+# We can save the parsed structure next to the source (osconfeed.json.cache) in a binary format that is faster to load:
+#   - marshal: the format of .pyc files. It only supports the built-in types, but JSON data is made of them.
+#     (marshal is not stable between Python versions, so the version is part of the key of the cache)
+#   - The cache is valid only if the source has the same key: path, mtime, size and hash of the content.
+#   - The header also has a hash of the marshal data: a corrupted cache can still be valid marshal data (a changed letter in
+#     a string), we check the hash before loading it.
+#   - If the cache is stale, corrupted or unreadable, we parse the source again and rewrite the cache.
+#   - The GC is paused while loading: it would run many times for nothing, while millions of containers are created.
+# 
+import gc
+import hashlib
+import marshal
+import os
+import sys
+from pathlib import Path
+
+FEED_CACHE_MAGIC = b'FEEDCACHE2\n'
+
+def _payload_digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def feed_key(path) -> tuple:
+    path = Path(path).resolve()
+    stat = path.stat()
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as fp:
+        while chunk := fp.read(1 << 20):
+            digest.update(chunk)
+    return (str(path), stat.st_mtime_ns, stat.st_size, digest.hexdigest(), sys.version_info[:2], marshal.version)
+
+def load_feed(path, cache_path=None):
+    """json.load(open(path)) with a marshal cache next to the source"""
+    path = Path(path)
+    cache_path = Path(cache_path) if cache_path else path.with_name(path.name + '.cache')
+    key = feed_key(path)
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        with open(cache_path, 'rb') as fp:
+            if fp.read(len(FEED_CACHE_MAGIC)) == FEED_CACHE_MAGIC:
+                header_size = int.from_bytes(fp.read(4), 'little')
+                cached_key, digest = marshal.loads(fp.read(header_size))
+                if cached_key == key:
+                    data = fp.read()        # marshal.load(fp) would read the file in many small pieces
+                    if _payload_digest(data) == digest:
+                        return marshal.loads(data)
+    except OSError:         # No cache, or we can't read it (a directory, permissions...)
+        pass
+    except (EOFError, ValueError, TypeError):   # A corrupted cache is just a cache miss
+        pass
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    with open(path, encoding='utf8') as fp:
+        json_data = json.load(fp)
+    tmp_path = cache_path.with_name(f'{cache_path.name}.{os.getpid()}.tmp')
+    try:
+        data = marshal.dumps(json_data)
+        with open(tmp_path, 'wb') as fp:
+            header = marshal.dumps((key, _payload_digest(data)))
+            fp.write(FEED_CACHE_MAGIC + len(header).to_bytes(4, 'little') + header)
+            fp.write(data)
+        os.replace(tmp_path, cache_path)        # Atomic: another process never sees half of a cache
+    except OSError:                             # ex: read-only directory. We can live without the cache
+        tmp_path.unlink(missing_ok=True)
+    return json_data
+
+# Test :
+"""
+PATH = Path(__file__).parent / "osconfeed.json"
+json_data = load_feed(PATH)             # parse the JSON and write osconfeed.json.cache
+json_data = load_feed(PATH)             # read osconfeed.json.cache
+print(json_data['Schedule']['speakers'][-1]['name'])    # Robert Lefkowitz
+feed = FrozenJSON(load_feed(PATH))
+"""
+
+def bench_feed_cache(path) -> None:
+    cache_path = Path(path).with_name(Path(path).name + '.cache')
+    cache_path.unlink(missing_ok=True)
+    for label in ('cold', 'warm'):
+        t0 = time.perf_counter()
+        load_feed(path)
+        print(f'{label}: {time.perf_counter() - t0:6.2f}s')
+    t0 = time.perf_counter()
+    feed_key(path)
+    print(f'      ({time.perf_counter() - t0:.2f}s of the warm startup is spent hashing the source)')
+
+# Test :
+"""
+write_big_feed('/tmp/bigfeed.json', events=200_000)
+bench_feed_cache('/tmp/bigfeed.json')
+# cold:   1.43s                 # json.load + writing the cache
+# warm:   0.60s                 # (0.47s without the hash of the cache: it costs ~0.1s, for a cache of 60MB)
+#       (0.14s of the warm startup is spent hashing the source)
+"""
+
+
 ############## Using a Property for Attribute Validation: 
 class LineItem:
     def __init__(self, description, weight, price):
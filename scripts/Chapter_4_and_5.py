@@ -101,9 +101,207 @@ def test_sub():
   print (re.sub(pattern, replace, string))    # abc12de23f456
 
 
-
-
-
+## Many patterns at once: a multi-pattern scanner
+# To scrub a log line with hundreds of patterns, calling re.sub once per pattern scans the line hundreds of times.
+# MultiScanner compiles the whole set once, and scans each line in one pass:
+#   - literals (plain strings) are found with an Aho-Corasick automaton: a trie of all the literals, with "failure" links that say
+#     where to continue when the next char doesn't match. Every occurrence of every literal is found in one pass over the line.
+#   - regexes are combined in a single alternation: (?:\d+)|(?:...)|... and the re engine scans the line once for all of them.
+#     (With a named group per pattern, match.lastgroup would tell which one matched, but capturing groups disable the optimizations
+#     of the re engine: 10x slower here. So we find the pattern afterwards: the first one that matches at the start of the match.)
+#   - The matches don't overlap: the leftmost match wins, then the longest, then the literals (and the first regex of the list).
+# Empty matches are ignored: where the alternation matches empty (a regex like x* comes first), the regexes are tried one by one
+# at this position, for the first one that matches something (slow, if a regex matches empty everywhere).
+# Limits: the regexes should not use numbered back-references (\1). Inside the alternation, a regex can't start with global
+# inline flags ((?i)abc: use a scoped group (?i:abc), or flags=), and a group name can't be used by two regexes:
+# MultiScanner raises ValueError.
+from collections import deque
+
+class AhoCorasick:
+    def __init__(self, words) -> None:
+        self.goto = [{}]                # node -> {char: next node}
+        self.fail = [0]
+        self.output = [[]]              # node -> [(length, index of the word)], longest first
+        for index, word in enumerate(words):
+            node = 0
+            for char in word:
+                if char not in self.goto[node]:
+                    self.goto[node][char] = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                node = self.goto[node][char]
+            self.output[node].append((len(word), index))
+        todo = deque(self.goto[0].values())    # Breadth-first: the failure link of a node points to a shorter (already done) node
+        while todo:
+            node = todo.popleft()
+            for char, child in self.goto[node].items():
+                todo.append(child)
+                fail = self.fail[node]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[child] = self.goto[fail].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def iter_matches(self, text):
+        """Yield (start, end, index of the word) for every occurrence of every word"""
+        goto, fail, output = self.goto, self.fail, self.output
+        node = 0
+        for position, char in enumerate(text, start=1):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for length, index in output[node]:
+                yield position - length, position, index
+
+
+class MultiScanner:
+    """findall / split / sub with many literals and regexes, in one pass per line.
+       literals and regexes: iterables of patterns, or dicts pattern -> replacement (str, or callable(matched_text))
+    """
+    def __init__(self, literals=(), regexes=(), flags=0) -> None:
+        literals = literals if isinstance(literals, dict) else dict.fromkeys(literals)
+        regexes = regexes if isinstance(regexes, dict) else dict.fromkeys(regexes)
+        self.patterns = [*literals, *regexes]
+        self.replacements = [*literals.values(), *regexes.values()]
+        self._literals = AhoCorasick(literals) if literals else None
+        self._regexes = [(index, re.compile(pattern, flags)) for index, pattern in enumerate(regexes, start=len(literals))]
+        group_names = set()
+        for pattern, (_, regex) in zip(regexes, self._regexes):
+            try:
+                re.compile(f'(?:{pattern})', flags)
+            except re.error as exc:
+                raise ValueError(f'regex {pattern!r} cannot be part of an alternation: {exc}') from None
+            if group_names & regex.groupindex.keys():
+                raise ValueError(f'regex {pattern!r}: the group names must be different in all the regexes')
+            group_names.update(regex.groupindex)
+        self._regex = re.compile('|'.join(f'(?:{pattern})' for pattern in regexes), flags) if regexes else None
+
+    def _literal_matches(self, line) -> dict:
+        """start -> (end, index) of the longest literal starting there"""
+        found = {}
+        if self._literals:
+            for start, end, index in self._literals.iter_matches(line):
+                if end > found.get(start, (-1,))[0]:
+                    found[start] = (end, index)
+        return found
+
+    def _search(self, line, pos):
+        match = self._regex.search(line, pos)
+        while match is not None and match.end() == match.start():     # Skip the empty matches
+            start = match.start()
+            for _, regex in self._regexes:     # A regex that comes after the one that matched empty
+                match = regex.match(line, start)
+                if match is not None and match.end() > start:
+                    return match
+            if start >= len(line):
+                return None
+            match = self._regex.search(line, start + 1)
+        return match
+
+    def _which(self, line, match) -> int:
+        """Index of the regex that produced the match: the first one that matches something at this position"""
+        for index, regex in self._regexes:
+            found = regex.match(line, match.start())
+            if found is not None and found.end() > found.start():
+                return index
+
+    def _matches(self, line):
+        """Yield (start, end, index of the pattern) for the matches, from left to right"""
+        literal_at = self._literal_matches(line)
+        starts = sorted(literal_at)
+        k = 0
+        regex_active = self._regex is not None
+        match = None
+        pos = 0
+        while True:
+            while k < len(starts) and starts[k] < pos:
+                k += 1
+            if regex_active and (match is None or match.start() < pos):
+                match = self._search(line, pos)
+                regex_active = match is not None
+            if k < len(starts):
+                start = starts[k]
+                end, index = literal_at[start]
+                if match is not None and (match.start() < start or (match.start() == start and match.end() > end)):
+                    start, end, index = match.start(), match.end(), self._which(line, match)
+            elif match is not None:
+                start, end, index = match.start(), match.end(), self._which(line, match)
+            else:
+                return
+            yield start, end, index
+            pos = end
+
+    def finditer(self, line):
+        """Yield (start, end, pattern) for the matches, from left to right"""
+        for start, end, index in self._matches(line):
+            yield start, end, self.patterns[index]
+
+    def findall(self, line) -> list[str]:
+        return [line[start:end] for start, end, _ in self._matches(line)]
+
+    def split(self, line) -> list[str]:
+        pieces = []
+        pos = 0
+        for start, end, _ in self._matches(line):
+            pieces.append(line[pos:start])
+            pos = end
+        pieces.append(line[pos:])
+        return pieces
+
+    def sub(self, line, repl=None) -> str:
+        """Replace each match with the replacement of its pattern (or repl when the pattern has none)"""
+        pieces = []
+        pos = 0
+        for start, end, index in self._matches(line):
+            replacement = self.replacements[index]
+            if replacement is None:
+                replacement = repl if repl is not None else ''
+            pieces.append(line[pos:start])
+            pieces.append(replacement(line[start:end]) if callable(replacement) else replacement)
+            pos = end
+        pieces.append(line[pos:])
+        return ''.join(pieces)
+
+def test_multi_scanner():
+    scanner = MultiScanner(literals={'hi': 'HI', 'Howdy': 'HOWDY'}, regexes={r'\d+': '#'})
+    print(scanner.findall('hello 12 hi 89. Howdy 34'))     # ['12', 'hi', '89', 'Howdy', '34']
+    print(scanner.split('11 Twelve:12 Eighty nine:89.'))    # ['', ' Twelve:', ' Eighty nine:', '.']
+    print(scanner.sub('hello 12 hi 89. Howdy 34'))          # hello # HI #. HOWDY #
+
+import time
+import random
+
+def bench_multi_scanner(lines: int = 2_000, literals: int = 300, regexes: int = 50, seed: int = 0) -> None:
+    """Scrub lines with many patterns: re.sub once per pattern versus MultiScanner.sub"""
+    rnd = random.Random(seed)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    words = [''.join(rnd.choices(letters, k=rnd.randint(5, 10))) for _ in range(literals)]
+    patterns = [rf'{rnd.choice(letters)}{rnd.choice(letters)}\d{{{rnd.randint(2, 6)}}}' for _ in range(regexes)]
+    log_lines = [
+        ' '.join(rnd.choice(words) if rnd.random() < 0.2 else ''.join(rnd.choices(letters + '0123456789', k=8)) for _ in range(15))
+        for _ in range(lines)
+    ]
+    compiled = [(re.compile(re.escape(word)), '***') for word in words] + [(re.compile(p), '<id>') for p in patterns]
+    t0 = time.perf_counter()
+    for line in log_lines:
+        for regex, replacement in compiled:
+            line = regex.sub(replacement, line)
+    sequential = time.perf_counter() - t0
+
+    scanner = MultiScanner(literals=dict.fromkeys(words, '***'), regexes=dict.fromkeys(patterns, '<id>'))
+    t0 = time.perf_counter()
+    for line in log_lines:
+        scanner.sub(line)
+    one_pass = time.perf_counter() - t0
+    print(f'{len(compiled)} patterns, {lines} lines')
+    print(f're.sub per pattern: {sequential / lines * 1e6:8.1f}µs per line')
+    print(f'MultiScanner.sub:   {one_pass / lines * 1e6:8.1f}µs per line')
+
+# bench_multi_scanner()
+# 350 patterns, 2000 lines
+# re.sub per pattern:     92.9µs per line
+# MultiScanner.sub:       38.5µs per line
 
 
 
@@ -129,6 +327,231 @@ string1 == string2 # false
 normalize('NFC', string1) == normalize('NFC', string2) # True
 # To read more about normalization: Check the Unicode standard : https://unicode.org/
 
+############## Normalizing lots of strings :
+# Normalizing both sides on every comparison redoes the same work for each pair: for a non ASCII string, CPython's
+# normalize (and is_normalized, whose quick check often answers "maybe") walks the whole string every time.
+# ASCII is always normalized and str.isascii() is O(1); the other strings go through a bounded cache of keys.
+import sys
+import unicodedata
+from functools import cache, lru_cache
+
+@lru_cache(maxsize=65_536)
+def _nfc_key(s: str) -> str:
+    # An already normalized string is its own key: the cache holds no second copy of it
+    return s if unicodedata.is_normalized('NFC', s) else normalize('NFC', s)
+
+def nfc(s: str) -> str:
+    """NFC form of s; ASCII strings skip the cache, other strings are normalized once while they stay in it"""
+    return s if s.isascii() else _nfc_key(s)
+
+def nfc_equal(s1: str, s2: str) -> bool:
+    return s1 == s2 or nfc(s1) == nfc(s2)
+
+print(nfc_equal(string1, string2))     # True
+print(nfc(string2) is string1)          # False: equal, but a new string
+print(nfc(s) is s)                      # True: the Arabic sample is already in NFC
+
+# A file is normalized chunk by chunk, but a chunk can end between a letter and its combining marks ('cafe' | '́'),
+# or just before a character that composes with the end of the chunk (Hangul jamo, the second letter of a composite).
+# So each chunk is cut before its last "stable" character: a starter (combining class 0) that never composes with what
+# precedes it and that is unchanged by the normalization. The tail after the cut waits for the next chunk.
+@cache
+def _composes_with_previous() -> frozenset[str]:
+    """Characters that can be the second part of a canonical composite (NFC_Quick_Check=Maybe), computed once"""
+    maybe = {chr(code) for code in range(0x1161, 0x1176)} | {chr(code) for code in range(0x11A8, 0x11C3)}   # Hangul V and T jamo
+    for code in range(sys.maxunicode + 1):
+        decomposition = unicodedata.decomposition(chr(code))
+        if decomposition and not decomposition.startswith('<'):     # canonical, not a compatibility mapping
+            parts = decomposition.split()
+            if len(parts) == 2:
+                maybe.add(chr(int(parts[1], 16)))
+    return frozenset(maybe)
+
+def _last_stable(text: str, form: str) -> int:
+    maybe = _composes_with_previous()
+    for i in range(len(text) - 1, 0, -1):
+        char = text[i]
+        if not unicodedata.combining(char) and char not in maybe and unicodedata.is_normalized(form, char):
+            return i
+    return 0
+
+def normalize_stream(chunks, form: str = 'NFC'):
+    """Yield the normalized text of an iterable of str chunks, the same as normalize(form, ''.join(chunks))"""
+    if form not in ('NFC', 'NFD'):
+        raise ValueError(f'unsupported form for streaming: {form!r}')   # NFKC/NFKD can turn a starter into a combining mark
+    carry = ''
+    for chunk in chunks:
+        text = carry + chunk
+        cut = _last_stable(text, form)
+        head, carry = text[:cut], text[cut:]
+        if head:
+            yield head if head.isascii() else normalize(form, head)
+    if carry:
+        yield normalize(form, carry)
+
+def normalize_file(src, dst, form: str = 'NFC', chunk_size: int = 1 << 20) -> None:
+    with open(src, encoding='utf-8') as fin, open(dst, 'w', encoding='utf-8') as fout:
+        fout.writelines(normalize_stream(iter(lambda: fin.read(chunk_size), ''), form))
+
+def bench_normalization(words: int = 200_000, seed: int = 0) -> None:
+    """Compare record pairs from mixed-script data: normalize both sides every time versus nfc_equal"""
+    rnd = random.Random(seed)
+    vocabulary = [
+        'hello', 'world', 'python', s, 'مرحبا', 'كتاب', 'Ελλάδα', 'Москва', '東京', 'naïve', 'São Paulo',
+        string1, string2, 'A\N{COMBINING RING ABOVE}ngström', 'Ångström', '각', '각',
+    ]
+    # Records of a few words, drawn from a few thousand distinct values as in a real column, about a third pure ASCII
+    records = [' '.join(rnd.choices(vocabulary[:3] if rnd.random() < 0.3 else vocabulary, k=rnd.randint(2, 6))) for _ in range(5_000)]
+    pairs = [(rnd.choice(records), rnd.choice(records)) for _ in range(words)]
+    t0 = time.perf_counter()
+    naive = [normalize('NFC', a) == normalize('NFC', b) for a, b in pairs]
+    t_naive = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    fast = [nfc_equal(a, b) for a, b in pairs]
+    t_fast = time.perf_counter() - t0
+    assert naive == fast
+    print(f'{words} comparisons, {sum(fast)} equal')
+    print(f'normalize both sides: {t_naive * 1e3:7.1f}ms')
+    print(f'nfc_equal:            {t_fast * 1e3:7.1f}ms')
+
+    text = ' '.join(rnd.choices(records, k=words))
+    t0 = time.perf_counter()
+    whole = normalize('NFC', text)
+    t_whole = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    streamed = ''.join(normalize_stream(text[i:i + 65_536] for i in range(0, len(text), 65_536)))
+    t_stream = time.perf_counter() - t0
+    assert streamed == whole
+    print(f'{len(text) / 1e6:.1f}M chars: whole {t_whole * 1e3:.1f}ms, streamed in 64K chunks {t_stream * 1e3:.1f}ms')
+
+# The table of _composes_with_previous() is built by the first call of normalize_stream (~0.3s), not at import:
+# text = 'cafe\N{COMBINING ACUTE ACCENT} 각 A\N{COMBINING RING ABOVE}\N{COMBINING CEDILLA} ' + s
+# chunks = [text[i:i + 1] for i in range(len(text))]     # the worst case: one character per chunk
+# print(''.join(normalize_stream(chunks)) == normalize('NFC', text))     # True
+#
+# bench_normalization()
+# 200000 comparisons, 188 equal
+# normalize both sides:   328.7ms
+# nfc_equal:              103.4ms
+# 5.0M chars: whole 270.7ms, streamed in 64K chunks 227.5ms
+
+############## Counting characters, bytes and lines of a big file :
+# len(s) counts characters and len(s.encode('utf8')) counts bytes. For a file of several GB, we read it in chunks into
+# one reusable bytearray (readinto: no new bytes object per read), and an incremental decoder keeps the bytes of a
+# character cut at the end of a chunk until the next one.
+# '\n' is a single byte that never appears inside a multibyte UTF-8 sequence, so lines are counted on the raw bytes.
+import codecs
+import threading
+import tracemalloc
+from typing import NamedTuple
+
+class ChunkStats(NamedTuple):
+    offset: int     # position of the chunk in the file
+    bytes: int
+    chars: int      # characters completed in this chunk
+    lines: int
+    invalid: int    # invalid byte sequences, each decoded as U+FFFD
+
+# Error handlers are global, so the counter is per thread: two threads can read two files at the same time.
+# It starts at 0 in each thread: any decode can use errors='count_invalid', not only utf8_chunk_stats.
+class _InvalidCounter(threading.local):
+    count = 0
+
+_invalid = _InvalidCounter()
+
+def _count_invalid(error: UnicodeDecodeError):
+    _invalid.count += 1
+    return '\N{REPLACEMENT CHARACTER}', error.end
+
+codecs.register_error('count_invalid', _count_invalid)
+
+def utf8_chunk_stats(path, chunk_size: int = 1 << 20):
+    """Yield a ChunkStats per chunk of the file; memory stays O(chunk_size) whatever the size of the file"""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='count_invalid')
+    buffer = bytearray(chunk_size)
+    offset = 0
+    with open(path, 'rb', buffering=0) as fp:
+        while size := fp.readinto(buffer):
+            data = buffer if size == chunk_size else buffer[:size]
+            _invalid.count = 0
+            if data.isascii() and not decoder.getstate()[0]:
+                chars = size        # one byte, one character: no need to decode
+            else:
+                chars = len(decoder.decode(data))
+            yield ChunkStats(offset, size, chars, data.count(b'\n'), _invalid.count)
+            offset += size
+    _invalid.count = 0
+    chars = len(decoder.decode(b'', final=True))    # a truncated character at the end of the file
+    if chars:
+        yield ChunkStats(offset, 0, chars, 0, _invalid.count)
+
+def utf8_stats(path, chunk_size: int = 1 << 20) -> ChunkStats:
+    """Totals for the whole file"""
+    total_bytes = total_chars = total_lines = total_invalid = 0
+    for stats in utf8_chunk_stats(path, chunk_size):
+        total_bytes += stats.bytes
+        total_chars += stats.chars
+        total_lines += stats.lines
+        total_invalid += stats.invalid
+    return ChunkStats(0, total_bytes, total_chars, total_lines, total_invalid)
+
+def write_mixed_text(path, size_mb: int = 200, seed: int = 0) -> None:
+    """Lines of ASCII, Arabic, Greek and CJK words, with a few invalid bytes"""
+    rnd = random.Random(seed)
+    words = ['hello', 'world', 'python', s, 'مرحبا', 'Ελλάδα', 'Москва', '東京', 'café']
+    lines = [' '.join(rnd.choices(words if rnd.random() < 0.5 else words[:3], k=12)).encode('utf8') for _ in range(10_000)]
+    block = b'\n'.join(lines) + b'\n\xff\n'
+    with open(path, 'wb') as fp:
+        for _ in range(size_mb * 2**20 // len(block) + 1):
+            fp.write(block)
+
+def bench_utf8_stats(path='/tmp/mixed.txt', size_mb: int = 200) -> None:
+    """Raw reads versus utf8_stats versus reading the whole file as text"""
+    if not os.path.exists(path):
+        write_mixed_text(path, size_mb)
+    size = os.path.getsize(path)
+    buffer = bytearray(1 << 20)
+    t0 = time.perf_counter()
+    with open(path, 'rb', buffering=0) as fp:
+        while fp.readinto(buffer):
+            pass
+    t_raw = time.perf_counter() - t0
+
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    stats = utf8_stats(path)
+    t_stream = time.perf_counter() - t0
+    peak_stream = tracemalloc.get_traced_memory()[1]
+    tracemalloc.reset_peak()
+    t0 = time.perf_counter()
+    with open(path, encoding='utf8', errors='replace') as fp:
+        text = fp.read()
+    chars, lines = len(text), text.count('\n')
+    del text
+    t_whole = time.perf_counter() - t0
+    peak_whole = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert (chars, lines) == (stats.chars, stats.lines)
+    print(stats)
+    print(f'raw readinto: {size / 2**20 / t_raw:7.0f} MB/s')
+    print(f'utf8_stats:   {size / 2**20 / t_stream:7.0f} MB/s, peak {peak_stream / 2**20:6.1f} MB')
+    print(f'read() all:   {size / 2**20 / t_whole:7.0f} MB/s, peak {peak_whole / 2**20:6.1f} MB')
+
+# import tempfile
+# with tempfile.NamedTemporaryFile(suffix='.txt', delete=False) as sample:
+#     sample.write((s + '\n').encode('utf8') * 3 + b'caf\xc3' + b'\xff\n')    # a truncated é and a byte that is never valid
+# for stats in utf8_chunk_stats(sample.name, chunk_size=5):       # tiny chunks: most characters are cut in two
+#     print(stats)
+# print(utf8_stats(sample.name))     # ChunkStats(offset=0, bytes=51, chars=30, lines=4, invalid=2)
+# os.remove(sample.name)
+#
+# bench_utf8_stats()      # 200MB file, in the page cache
+# ChunkStats(offset=0, bytes=210575904, chars=167209280, lines=2240224, invalid=224)
+# raw readinto:    5779 MB/s
+# utf8_stats:       311 MB/s, peak    5.1 MB
+# read() all:        50 MB/s, peak  803.3 MB
+# Decoding is the limit (bytes.decode alone runs at ~430 MB/s on this text): about the speed of a SATA SSD.
+
 ####################################################
 ##############  Chapter 5: Data Class Builders
 ####################################################
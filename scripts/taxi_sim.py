@@ -0,0 +1,135 @@
+#######################################################################
+##############  Taxi fleet simulation (Chapter 19)
+#######################################################################
+# A discrete event simulation driven by coroutines:
+#   - each process (a taxi) is a generator that yields Event(time, proc, action) and receives the time of its next action,
+#   - the simulator keeps the pending events in a heap, ordered by time, and always resumes the process whose event is
+#     the earliest. The simulated clock jumps from event to event: nothing waits for real time to pass.
+#
+# Ties: two events can happen at the same time. The heap entries are (time, sequence number, event, process), where the
+# sequence number comes from itertools.count(): events at the same time are processed in the order they were scheduled,
+# and the heap never compares two events (or two generators, which cannot be compared).
+# All the randomness comes from one random.Random(seed): the same seed gives the same simulation.
+#
+# Usage:
+#   python taxi_sim.py                          # 3 taxis, prints the events, as in the book
+#   python taxi_sim.py -t 5000 -n 200 -e 1000000 -q     # thousands of taxis, millions of events: only the stats
+import argparse
+import itertools
+import random
+import time
+from collections import namedtuple
+from heapq import heappop, heappush
+
+DEFAULT_NUMBER_OF_TAXIS = 3
+DEFAULT_END_TIME = 180
+SEARCH_DURATION = 5
+TRIP_DURATION = 20
+DEPARTURE_INTERVAL = 5
+
+Event = namedtuple('Event', 'time proc action')
+SimStats = namedtuple('SimStats', 'events sim_time wall_time events_per_sec running')
+
+def taxi_process(ident, trips, start_time=0):
+    """Yield to the simulator an event at each change of state"""
+    time = yield Event(start_time, ident, 'leave garage')
+    for _ in range(trips):
+        time = yield Event(time, ident, 'pick up passenger')
+        time = yield Event(time, ident, 'drop off passenger')
+    yield Event(time, ident, 'going home')
+    # end of taxi process
+
+MEAN_DURATIONS = {
+    'leave garage': SEARCH_DURATION,
+    'pick up passenger': TRIP_DURATION,
+    'drop off passenger': SEARCH_DURATION,
+}
+
+def compute_duration(previous_action, rnd: random.Random) -> int:
+    """Time until the next action, drawn from an exponential distribution"""
+    if previous_action == 'going home':
+        return 1
+    try:
+        interval = MEAN_DURATIONS[previous_action]
+    except KeyError:
+        raise ValueError(f'Unknown previous_action: {previous_action}') from None
+    return int(rnd.expovariate(1 / interval)) + 1
+
+class Simulator:
+    def __init__(self, procs_map, duration=compute_duration, seed=None):
+        self.events = []        # heap of (time, sequence, event, process)
+        self.procs = dict(procs_map)
+        self.duration = duration
+        self.rnd = random.Random(seed)
+        self._sequence = itertools.count()
+
+    def schedule(self, event: Event, proc) -> None:
+        heappush(self.events, (event.time, next(self._sequence), event, proc))
+
+    def run(self, end_time, trace=True) -> SimStats:
+        """Schedule and process events until the end time, or until no process is left"""
+        for proc in self.procs.values():
+            self.schedule(next(proc), proc)     # prime each coroutine: its first event
+
+        # The main loop runs once per event: the attributes and functions it uses are local variables
+        events, procs, rnd, duration = self.events, self.procs, self.rnd, self.duration
+        sequence = self._sequence
+        processed = 0
+        sim_time = 0
+        t0 = time.perf_counter()
+        while events:
+            if events[0][0] >= end_time:
+                break
+            sim_time, _, event, proc = heappop(events)
+            if trace:
+                print('taxi:', event.proc, event.proc * '   ', event)
+            processed += 1
+            next_time = sim_time + duration(event.action, rnd)
+            try:
+                next_event = proc.send(next_time)
+            except StopIteration:
+                del procs[event.proc]
+            else:
+                heappush(events, (next_event.time, next(sequence), next_event, proc))
+        wall_time = time.perf_counter() - t0
+        if trace:
+            if events:
+                print(f'*** end of simulation time: {len(events)} events pending ***')
+            else:
+                print('*** end of events ***')
+        return SimStats(processed, sim_time, wall_time, processed / wall_time if wall_time else 0.0, len(procs))
+
+def make_fleet(num_taxis: int, trips: int, rnd: random.Random) -> dict:
+    """Taxi i leaves the garage at i * DEPARTURE_INTERVAL, for trips//2 to 3*trips//2 trips"""
+    return {i: taxi_process(i, rnd.randint(max(trips // 2, 1), max(trips * 3 // 2, 1)), i * DEPARTURE_INTERVAL)
+            for i in range(num_taxis)}
+
+def main(end_time=DEFAULT_END_TIME, num_taxis=DEFAULT_NUMBER_OF_TAXIS, trips=4, seed=None, trace=True) -> SimStats:
+    rnd = random.Random(seed)
+    sim = Simulator(make_fleet(num_taxis, trips, rnd), seed=rnd.getrandbits(64))
+    stats = sim.run(end_time, trace)
+    print(f'{stats.events:,} events, simulated time {stats.sim_time}, {stats.running} taxis still running')
+    print(f'{stats.wall_time:.3f}s, {stats.events_per_sec:,.0f} events/s')
+    return stats
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Taxi fleet simulator.')
+    parser.add_argument('-e', '--end-time', type=int, default=DEFAULT_END_TIME,
+                        help=f'simulation end time; default = {DEFAULT_END_TIME}')
+    parser.add_argument('-t', '--taxis', type=int, default=DEFAULT_NUMBER_OF_TAXIS,
+                        help=f'number of taxis running; default = {DEFAULT_NUMBER_OF_TAXIS}')
+    parser.add_argument('-n', '--trips', type=int, default=4, help='average number of trips per taxi; default = 4')
+    parser.add_argument('-s', '--seed', type=int, default=None, help='random generator seed (for testing)')
+    parser.add_argument('-q', '--quiet', action='store_true', help='only print the stats, not the events')
+    args = parser.parse_args()
+    main(args.end_time, args.taxis, args.trips, args.seed, trace=not args.quiet)
+
+# python taxi_sim.py -s 3 | tail -4
+# taxi: 2        Event(time=140, proc=2, action='going home')
+# *** end of events ***
+# 36 events, simulated time 140, 0 taxis still running
+# 0.001s, 26,164 events/s
+#
+# python taxi_sim.py -t 5000 -n 200 -e 1000000 -s 1 -q
+# 2,009,152 events, simulated time 33070, 0 taxis still running
+# 4.249s, 472,881 events/s